@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import gcov2html
+
+# ========================
+# Cấu hình corpus mẫu (--scale nhân số file, hoặc số dòng nếu scale_lines)
+# ========================
+CORPORA = {
+    'many_small': {'files': 2000, 'lines': 60, 'depth': 2, 'branch_every': 10},
+    'huge_files': {'files': 3, 'lines': 500000, 'depth': 1, 'branch_every': 12, 'scale_lines': True},
+    'branch_heavy': {'files': 100, 'lines': 3000, 'depth': 2, 'branch_every': 1},
+    'deep_tree': {'files': 1000, 'lines': 80, 'depth': 12, 'branch_every': 10},
+}
+
+CODE_SNIPPETS = [
+    "    value += compute(index, `tick`);",
+    "    if (buffer[i] > limit) {",
+    "    for (int i = 0; i < count; i++) {",
+    "    while (node != NULL && node->next) {",
+    "    } else {",
+    "    return result; /* <done> & ${x} */",
+    "    int tmp = lookup(table, key);",
+    "    memcpy(dst, src, sizeof(struct header));",
+]
+
+# ========================
+# Sinh file .gcov giả lập
+# ========================
+def write_gcov(path, source, line_count, branch_every, rng):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"        -:    0:Source:{source}\n        -:    0:Runs:1\n")
+        for line_no in range(1, line_count + 1):
+            roll = rng.random()
+            if roll < 0.3:
+                count = '-'
+            elif roll < 0.45:
+                count = '#####'
+            else:
+                count = str(rng.randint(1, 100000))
+            if line_no % 50 == 1 and count != '-':
+                f.write(f"function fn_{line_no} called {rng.randint(0, 9)} returned 100% blocks executed 80%\n")
+            code = CODE_SNIPPETS[line_no % len(CODE_SNIPPETS)]
+            if branch_every and line_no % branch_every == 0:
+                code = CODE_SNIPPETS[1]
+            f.write(f"{count:>9}:{line_no:>5}:{code}\n")
+            if branch_every and line_no % branch_every == 0 and count != '-':
+                for branch in range(4):
+                    f.write(f"branch  {branch} taken {rng.choice((0, 25, 50, 100))}%\n")
+
+def generate_corpus(root, spec, scale, seed=1):
+    rng = random.Random(seed)
+    if spec.get('scale_lines'):
+        files, lines = spec['files'], max(10, int(spec['lines'] * scale))
+    else:
+        files, lines = max(1, int(spec['files'] * scale)), spec['lines']
+    for n in range(files):
+        parts = [f"dir{(n >> (2 * level)) % 4}" for level in range(spec['depth'])]
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        source = '/'.join(parts + [f"file{n}.c"])
+        write_gcov(os.path.join(directory, f"file{n}.c.gcov"), source, lines, spec['branch_every'], rng)
+
+# ========================
+# Đo từng giai đoạn
+# ========================
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS trả về byte, Linux trả về KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_pipeline(corpus_dir, work_dir):
+    stages = {}
+    os.chdir(work_dir)
+    os.makedirs(gcov2html.OUTPUT_DIR, exist_ok=True)
+
+    start = time.perf_counter()
+    gcov_files = list(gcov2html.discover_gcov_files(roots=[corpus_dir]))
+    stages['discovery'] = time.perf_counter() - start
+
+    # Ghi trang qua writer nền như gcov2html để đo đúng đường ghi thật (render, ghi, chờ hàng đợi)
+    stats = gcov2html.new_stage_stats()
+    writer = gcov2html.get_writer()
+    line_count = 0
+    reports = []
+    for gcov_file in gcov_files:
+        start = time.perf_counter()
+        model = gcov2html.parse_gcov(gcov_file)
+        stats['parse'] += time.perf_counter() - start
+        if model is None:
+            continue
+        line_count += len(model['lines'])
+
+        html_filename = f"file{len(reports)}.html"
+        if not gcov2html.write_gcov_html(model, os.path.join(gcov2html.OUTPUT_DIR, html_filename),
+                                         os.path.dirname(gcov_file), stats, writer=writer):
+            raise RuntimeError(f"không ghi được trang của {gcov_file}")
+
+        reports.append({
+            'name': os.path.basename(gcov_file)[:-5],
+            'covered': model['covered'],
+            'total': model['total'],
+            'branch_taken': model['branch_taken'],
+            'branch_total': model['branch_total'],
+            'branch_percent': model['branch_percent'],
+            'html_file': html_filename,
+            'relative_path': os.path.relpath(gcov_file, corpus_dir)[:-5],
+        })
+
+    # Các trang còn đang ghi được drain ở đây; phần chờ này cũng là thời gian pipeline phải trả
+    start = time.perf_counter()
+    written = gcov2html.close_writer()
+    if written['failures']:
+        raise RuntimeError(f"không ghi được {len(written['failures'])} trang")
+    stats['write_wait'] += time.perf_counter() - start
+    stages['parse'] = stats['parse']
+    stages['render'] = stats['render']
+    # Thread ghi chạy song song với render: pipeline chỉ tốn phần thời gian phải chờ writer
+    stages['write'] = stats['write_wait']
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        gcov2html.generate_index_html(reports)
+    stages['index'] = time.perf_counter() - start
+
+    return {
+        'files': len(gcov_files),
+        'lines': line_count,
+        'bytes_written': written['bytes'],
+        'write_thread_seconds': round(written['write'], 4),
+        'stages': {name: round(value, 4) for name, value in stages.items()},
+        'total_seconds': round(sum(stages.values()), 4),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+def _bench_worker(corpus_dir, work_dir, conn):
+    conn.send(run_pipeline(corpus_dir, work_dir))
+    conn.close()
+
+def bench_corpus(corpus_dir, work_dir):
+    # Chạy mỗi corpus trong tiến trình riêng để peak RSS không bị cộng dồn
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_bench_worker, args=(corpus_dir, work_dir, child))
+    process.start()
+    # Đóng đầu ghi ở tiến trình cha để recv() nhận EOFError thay vì treo khi worker chết
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = None
+    finally:
+        parent.close()
+        process.join()
+    if result is None:
+        raise RuntimeError(f"benchmark {corpus_dir} thất bại (exit code {process.exitcode})")
+    return result
+
+# ========================
+# So sánh với lần chạy trước
+# ========================
+def compare_results(current, baseline):
+    for name, result in current['corpora'].items():
+        old = baseline.get('corpora', {}).get(name)
+        if not old:
+            continue
+        print(f"\n{name}:")
+        for stage, seconds in result['stages'].items():
+            before = old['stages'].get(stage)
+            if before:
+                change = (seconds - before) / before * 100
+                print(f"  {stage:<10} {before:>9.3f}s → {seconds:>9.3f}s ({change:+.1f}%)")
+        if result['peak_rss_kb'] and old.get('peak_rss_kb'):
+            print(f"  {'peak_rss':<10} {old['peak_rss_kb']:>8}KB → {result['peak_rss_kb']:>8}KB")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# ========================
+# Main
+# ========================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline gcov2html.py với corpus .gcov giả lập.")
+    parser.add_argument('--corpus', action='append', choices=sorted(CORPORA),
+                        help="corpus cần chạy, có thể lặp lại (mặc định: tất cả)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="hệ số kích thước corpus (vd. 0.1 để chạy nhanh)")
+    parser.add_argument('--output', default='bench_results.json', help="file JSON kết quả")
+    parser.add_argument('--compare', metavar='FILE', help="so sánh với file kết quả của lần chạy trước")
+    parser.add_argument('--keep', metavar='DIR', help="giữ corpus đã sinh trong DIR để dùng lại")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    base_dir = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp(prefix='gcov2html-bench-')
+    output = os.path.abspath(args.output)
+
+    results = {
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'corpora': {},
+    }
+
+    try:
+        for name in args.corpus or sorted(CORPORA):
+            corpus_dir = os.path.join(base_dir, name, 'input')
+            work_dir = os.path.join(base_dir, name, 'work')
+            if not os.path.isdir(corpus_dir):
+                print(f"[..] Sinh corpus {name}...")
+                generate_corpus(corpus_dir, CORPORA[name], args.scale)
+            if os.path.isdir(work_dir):
+                shutil.rmtree(work_dir)
+            os.makedirs(work_dir)
+
+            result = bench_corpus(corpus_dir, work_dir)
+            results['corpora'][name] = result
+            stages = " | ".join(f"{stage}: {seconds:.3f}s" for stage, seconds in result['stages'].items())
+            print(f"[OK] {name}: {result['files']} file, {result['lines']:,} dòng | {stages} | "
+                  f"peak RSS: {result['peak_rss_kb'] or '?'} KB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n📁 Kết quả: {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
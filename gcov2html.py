@@ -1,37 +1,266 @@
 import os
 import sys
-import glob
 import html
+import re
 import json
+import math
+import mmap
+import array
+import struct
+import time
+import heapq
+import bisect
 import shutil
+import hashlib
+import fnmatch
+import argparse
+import itertools
+import tempfile
+import threading
+import queue
+import multiprocessing
+import subprocess
 import webbrowser
+from collections import deque, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape, quoteattr
+
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 # ========================
 # Cấu hình
 # ========================
 OUTPUT_DIR = "coverage_html"
 INDEX_FILE = os.path.join(OUTPUT_DIR, "index.html")
 HISTORY_FILE = os.path.join(OUTPUT_DIR, "coverage_history.json")
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+CONTEXTS_FILE = os.path.join(OUTPUT_DIR, "contexts.json")
+PATCH_FILE = os.path.join(OUTPUT_DIR, "patch.html")
+MODEL_FILE = os.path.join(OUTPUT_DIR, "model.bin")
+
+# Thư mục đang ghi; khác OUTPUT_DIR khi đang sinh vào thư mục staging
+BUILD_DIR = OUTPUT_DIR
+STAGING_MAX_AGE = 24 * 3600
 
 LAZY_LOAD_THRESHOLD = 1000
 CHUNK_SIZE = 100
+HOTSPOT_LIMIT = 20          # Số dòng/hàm chạy nhiều nhất giữ lại cho mỗi file và cho toàn dự án
+HOTSPOT_CODE_WIDTH = 120
+HEAT_LEVELS = 9
+
+# Ghi HTML nền: số chunk tối đa đang chờ mỗi thread ghi (render bị chặn khi đầy) và số fsync chạy song song
+WRITE_THREADS = 2
+WRITE_QUEUE_CHUNKS = 64
+FSYNC_THREADS = 8
+
+# Cache token tô màu cú pháp, khoá theo hash nội dung file; nằm trong cache của người dùng (không làm bẩn
+# thư mục dự án) và bị giới hạn dung lượng, xoá các mục lâu không dùng nhất trước (LRU theo mtime)
+HIGHLIGHT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                   'gcov2html', 'highlight')
+HIGHLIGHT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+HIGHLIGHT_VERSION = "1"
+
+# Thư mục bị bỏ qua khi quét (thư mục ẩn như .git luôn bị bỏ qua)
+DEFAULT_PRUNE_DIRS = {OUTPUT_DIR, '.gcov2html_cache', 'node_modules', '__pycache__', 'venv', 'bin', 'obj'}
+
+# Source nằm dưới các tiền tố này được coi là header hệ thống/bên ngoài
+EXTERNAL_PREFIXES = ('/usr/', '/opt/', '/Library/', '/Applications/', 'C:/Program Files')
 
 # ========================
-# Dọn dẹp thư mục HTML cũ
+# Log (mức log, dạng text hoặc JSON lines)
 # ========================
-if os.path.exists(OUTPUT_DIR):
-    shutil.rmtree(OUTPUT_DIR)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'quiet': 100}
+LOG_CONFIG = {'level': 'info', 'format': 'text', 'file_level': 'info'}
+PROGRESS_INTERVAL = 0.5
+WATCH_DEBOUNCE = 0.3
+
+def configure_logging(config):
+    if config:
+        LOG_CONFIG.update(config)
+
+def log_event(level, event, message, **fields):
+    if LOG_LEVELS[level] < LOG_LEVELS[LOG_CONFIG['level']]:
+        return
+    if LOG_CONFIG['format'] == 'json':
+        record = {'ts': round(time.time(), 3), 'level': level, 'event': event, **fields}
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    else:
+        stream = sys.stderr if LOG_LEVELS[level] >= LOG_LEVELS['warning'] else sys.stdout
+        print(message, file=stream)
+
+def make_progress(enabled):
+    # Cập nhật bộ đếm theo chu kỳ cố định thay vì mỗi file một dòng
+    state = {'last': 0.0, 'start': time.perf_counter(), 'shown': False}
+
+    def update(done, found, final=False):
+        if not enabled:
+            return
+        now = time.perf_counter()
+        if not final and now - state['last'] < PROGRESS_INTERVAL:
+            return
+        state['last'] = now
+        rate = done / (now - state['start']) if now > state['start'] else 0.0
+        if LOG_CONFIG['format'] == 'json':
+            log_event('info', 'progress', '', done=done, found=found, rate=round(rate, 1), final=final)
+            return
+        sys.stderr.write(f"\r[{done}/{found}] {rate:,.1f} file/s")
+        state['shown'] = True
+        if final:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+    return update
+
+# ========================
+# Sinh vào thư mục staging rồi đổi chỗ nguyên tử
+# ========================
+def set_build_dir(path):
+    global BUILD_DIR
+    if path:
+        BUILD_DIR = path
+
+def build_path(name):
+    return os.path.join(BUILD_DIR, name)
+
+def write_text_atomic(path, content):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def prepare_output_dir():
+    target = os.path.abspath(OUTPUT_DIR)
+    parent, name = os.path.split(target)
+    os.makedirs(parent, exist_ok=True)
+
+    # Dọn staging bị bỏ lại từ các lần chạy bị crash
+    prefix = f".{name}.staging-"
+    now = time.time()
+    for entry in os.scandir(parent):
+        try:
+            if entry.name.startswith(prefix) and now - entry.stat().st_mtime > STAGING_MAX_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            continue
+
+    staging = tempfile.mkdtemp(prefix=prefix, dir=parent)
+    try:
+        mode = os.stat(target).st_mode & 0o777
+    except OSError:
+        mode = 0o755
+    os.chmod(staging, mode)
+
+    history = os.path.join(target, os.path.basename(HISTORY_FILE))
+    if os.path.exists(history):
+        shutil.copy2(history, os.path.join(staging, os.path.basename(HISTORY_FILE)))
+    set_build_dir(staging)
+    return staging
+
+def _exchange_dirs(first, second):
+    # renameat2(RENAME_EXCHANGE): hoán đổi hai thư mục trong một thao tác (Linux ≥ 3.15)
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    at_fdcwd, rename_exchange = -100, 2
+    return renameat2(at_fdcwd, os.fsencode(first), at_fdcwd, os.fsencode(second), rename_exchange) == 0
+
+def fsync_path(path, directory=False):
+    fd = os.open(path, os.O_RDONLY | (getattr(os, 'O_DIRECTORY', 0) if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_output_dir(directory):
+    # fsync mọi file (trang, index, manifest...) song song rồi mới fsync bản thân thư mục
+    paths = [entry.path for entry in os.scandir(directory) if entry.is_file(follow_symlinks=False)]
+    with ThreadPoolExecutor(max_workers=FSYNC_THREADS) as pool:
+        list(pool.map(fsync_path, paths))
+    fsync_path(directory, directory=True)
+
+def publish_output(staging, sync=False):
+    target = os.path.abspath(OUTPUT_DIR)
+    if sync:
+        sync_output_dir(staging)
+    if os.path.isdir(target) and _exchange_dirs(staging, target):
+        # staging giờ chứa bản cũ
+        shutil.rmtree(staging, ignore_errors=True)
+    elif os.path.exists(target):
+        old = f"{staging}.old"
+        os.rename(target, old)
+        os.rename(staging, target)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.rename(staging, target)
+    if sync:
+        # Ghi nhận thao tác đổi tên vào thư mục cha
+        fsync_path(os.path.dirname(target), directory=True)
+    set_build_dir(OUTPUT_DIR)
+
+def discard_output(staging):
+    shutil.rmtree(staging, ignore_errors=True)
+    set_build_dir(OUTPUT_DIR)
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def render_signature(options):
+    # Trang cũ chỉ được dùng lại khi cùng phiên bản script và cùng tuỳ chọn render
+    with open(os.path.abspath(__file__), 'rb') as f:
+        digest = hashlib.sha1(f.read())
+    digest.update(json.dumps([options.get('source_filter'), options.get('highlight'), LAZY_LOAD_THRESHOLD, CHUNK_SIZE],
+                             sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+def reuse_unchanged(inputs, previous, reused):
+    # Trang của file .gcov không đổi được hardlink từ bản trước (copy nếu không link được)
+    for item in inputs:
+        old = previous.get(item) if isinstance(item, str) else None
+        if old is None or old.get('stamp') != file_stamp(item):
+            yield item
+            continue
+        source = os.path.join(OUTPUT_DIR, old['html_file'])
+        target = build_path(old['html_file'])
+        try:
+            os.link(source, target)
+        except OSError:
+            try:
+                shutil.copy2(source, target)
+            except OSError:
+                yield item
+                continue
+        reused.append(old)
 
 # ========================
 # Lịch sử coverage
 # ========================
 def load_history():
-    if os.path.exists(HISTORY_FILE):
+    history_file = build_path(os.path.basename(HISTORY_FILE))
+    if os.path.exists(history_file):
         try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+            with open(history_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except:
             return []
@@ -42,100 +271,439 @@ def save_history(entry):
     history.append(entry)
     if len(history) > 30:
         history = history[-30:]
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
+    with open(build_path(os.path.basename(HISTORY_FILE)), 'w', encoding='utf-8') as f:
         json.dump(history, f, indent=2, ensure_ascii=False)
 
 # ========================
-# Chuyển .gcov → HTML (giao diện chuyên nghiệp)
+# Parse .gcov → model (dùng chung cho HTML, check, export)
 # ========================
-def gcov_to_html(gcov_file, html_file, relative_path=""):
+def push_hotspot(heap, item, limit=HOTSPOT_LIMIT):
+    # Heap tối thiểu giới hạn kích thước: chỉ giữ limit phần tử lớn nhất
+    if len(heap) < limit:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+# Dòng có thể chạy nhưng chưa chạy: '#####' (đường thường) và '=====' (chỉ qua đường exception)
+UNEXECUTED_COUNTS = ('#####', '=====')
+
+def line_hits(count_str):
+    # "12*": dòng đã chạy nhưng còn block chưa chạy
+    count = count_str.rstrip('*')
+    return int(count) if count.isdigit() else 0
+
+def function_record(name, count):
+    # (tên, số lần gọi) của một hàm: dùng chung cho dòng "function" của .gcov, FNDA của LCOV và <method> Cobertura
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'ignore')
+    if isinstance(count, bytes):
+        count = count.decode('ascii', 'ignore')
+    return name, line_hits(count)
+
+def parse_function_line(line):
+    # "function NAME called N returned X% blocks executed Y%"; trả về None nếu không phải bản ghi hàm
+    if not line.startswith(b'function ') or b' called ' not in line:
+        return None
+    name, _, rest = line[9:].partition(b' called ')
+    return function_record(name, rest.split(b' ', 1)[0])
+
+# Heuristic nhánh: dòng mở block hoặc có if/else/while/for (một regex thay cho nhiều phép `in` trên bytes)
+BRANCH_HINT_RE = re.compile(rb'if \(|else|while|for|\{\s*$')
+BRANCH_TAKEN_RE = re.compile(rb'taken( 0)?')
+
+def read_gcov_lines(gcov_file):
+    # Một lần read + split trên bytes (không decode); parse_gcov chỉ cần truy cập ngẫu nhiên theo chỉ số dòng
+    with open(gcov_file, 'rb') as f:
+        return f.read().split(b'\n')
+
+def parse_gcov(gcov_file, decode_source=True):
+    # Quét trên bytes; mã nguồn chỉ được decode khi cần render (decode_source=False cho check/export)
     try:
-        with open(gcov_file, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
+        lines = read_gcov_lines(gcov_file)
     except Exception as e:
-        print(f"[ERROR] Không đọc được file {gcov_file}: {e}")
-        return 0, 0, 0.0
+        log_event('error', 'read_error', f"[ERROR] Không đọc được file {gcov_file}: {e}", file=gcov_file, error=str(e))
+        return None
 
     total_instrumented = 0
     covered = 0
-    uncovered_indices = []
     branch_total = 0
     branch_taken = 0
     branch_percent = 0.0
 
     for line in lines:
-        if "blocks executed" in line:
+        if b"blocks executed" in line:
             try:
-                percent_str = line.split("blocks executed ")[-1].replace('%', '').strip()
+                percent_str = line.split(b"blocks executed ")[-1].replace(b'%', b'').strip()
                 branch_percent = float(percent_str)
             except:
                 branch_percent = 0.0
             break
 
+    # Mỗi dòng: (index, line_num_str, count_str, code, branch_taken, branch_total)
     parsed_lines = []
+    functions = []
+    pending_functions = []
+    hot_lines = []
+    hot_functions = []
+    source = None
     i = 0
-    while i < len(lines):
+    line_count = len(lines)
+    branch_hint = BRANCH_HINT_RE.search
+    branch_taken_match = BRANCH_TAKEN_RE.search
+    while i < line_count:
         line = lines[i]
-        parts = line.split(':', 2)
-        if len(parts) < 3:
+        parts = line.split(b':', 2)
+        if len(parts) < 3 or (line[0] == 0x66 and line.startswith(b'function ')):
+            # Tên hàm có thể chứa ':' (C++) nên dòng "function" không phải dòng mã nguồn
+            function = parse_function_line(line)
+            if function:
+                pending_functions.append(function)
             i += 1
             continue
+        count_bytes, line_num_bytes, code_bytes = parts
 
-        count_str = parts[0].strip()
-        line_num_str = parts[1].strip()
-        code = parts[2].rstrip('\n')
-
-        is_instrumented = count_str != '-' and not count_str.startswith('====')
-        is_covered = is_instrumented and count_str.isdigit() and int(count_str) > 0
-        is_uncovered = '#####' in count_str
-
-        if is_instrumented:
+        count_bytes = count_bytes.strip()
+        try:
+            line_num_str = line_num_bytes.strip().decode()
+        except UnicodeDecodeError:
+            i += 1
+            continue
+        code_bytes = code_bytes.rstrip(b'\n')
+        code = ''
+        if decode_source:
+            try:
+                code = code_bytes.decode()
+            except UnicodeDecodeError:
+                code = code_bytes.decode('utf-8', 'ignore')
+
+        if line_num_str == '0':
+            if code_bytes.startswith(b'Source:'):
+                source = code_bytes[7:].strip().decode('utf-8', 'ignore')
+        elif pending_functions:
+            for name, called in pending_functions:
+                functions.append((name, line_num_str, called))
+                push_hotspot(hot_functions, (called, name, line_num_str))
+            pending_functions = []
+
+        if count_bytes == b'-':
+            count_str = '-'
+        else:
+            if count_bytes.isdigit():
+                count_str = count_bytes.decode()
+                hits = int(count_bytes)
+            else:
+                count_str = count_bytes.decode('utf-8', 'ignore')
+                hits = line_hits(count_str)
             total_instrumented += 1
-            if is_covered:
+            if hits > 0:
                 covered += 1
-            elif is_uncovered:
-                uncovered_indices.append(i)
+                # Giữ bytes trong heap, chỉ decode HOTSPOT_LIMIT dòng còn lại ở cuối
+                if len(hot_lines) < HOTSPOT_LIMIT or hits >= hot_lines[0][0]:
+                    push_hotspot(hot_lines, (hits, line_num_str, code_bytes.strip()))
 
-        code = html.escape(code)
-        line_num_str = html.escape(line_num_str)
-        count_str_display = html.escape(count_str).ljust(8)
+        line_taken = 0
+        line_total = 0
+        if branch_hint(code_bytes):
+            j = i + 1
+            while j < line_count and lines[j].lstrip().startswith(b'branch'):
+                taken = branch_taken_match(lines[j])
+                if taken:
+                    line_total += 1
+                    if not taken.group(1):
+                        line_taken += 1
+                j += 1
+            branch_total += line_total
+            branch_taken += line_taken
 
-        if count_str == '-':
-            css_class = 'uninstrumented'
-        elif is_uncovered:
-            css_class = 'uncovered'
-        else:
-            css_class = 'covered'
+        parsed_lines.append((i, line_num_str, count_str, code, line_taken, line_total))
+        i += 1
 
-        prefix = ""
-        if is_uncovered:
-            prefix = "[MISS] "
-        elif is_covered:
-            prefix = f"[{count_str_display.strip()}x] "
+    hot_lines = [(hits, line_num_str, code.decode('utf-8', 'ignore')[:HOTSPOT_CODE_WIDTH])
+                 for hits, line_num_str, code in sorted(hot_lines, reverse=True)]
 
-        html_line = f"<span class='{css_class}' data-line='{i}'><span class='line-num'>{line_num_str}</span> {prefix}{code}</span>"
+    if branch_total > 0:
+        branch_percent = (branch_taken / branch_total * 100)
 
-        parsed_lines.append({
-            'html': html_line,
-            'class': css_class,
-            'index': i
-        })
+    return {
+        'gcov_file': gcov_file,
+        'source': source,
+        'lines': parsed_lines,
+        'functions': functions,
+        'hot_lines': hot_lines,
+        'hot_functions': sorted(hot_functions, reverse=True),
+        'covered': covered,
+        'total': total_instrumented,
+        'branch_taken': branch_taken,
+        'branch_total': branch_total,
+        'branch_percent': branch_percent,
+    }
 
-        if code.strip().endswith('{') or 'if (' in code or 'else' in code or 'while' in code or 'for' in code:
-            j = i + 1
-            while j < len(lines) and lines[j].strip().startswith('branch'):
-                branch_line = lines[j].strip()
-                if 'taken' in branch_line:
-                    branch_total += 1
-                    if 'taken 0' not in branch_line:
-                        branch_taken += 1
-                j += 1
+# ========================
+# Tô màu cú pháp C/C++ (regex, cache theo hash nội dung)
+# ========================
+C_KEYWORDS = (
+    'auto break case char const continue default do double else enum extern float for goto if inline '
+    'int long register restrict return short signed sizeof static struct switch typedef union unsigned '
+    'void volatile while bool true false nullptr class namespace template typename public private '
+    'protected virtual override final operator new delete this throw try catch using constexpr '
+    'noexcept static_cast dynamic_cast reinterpret_cast const_cast explicit friend mutable decltype'
+).split()
+
+C_TOKEN_RE = re.compile(r"""
+    (?P<com>//.*|/\*.*?(?:\*/|$))
+  | (?P<str>"(?:\\.|[^"\\])*"?|'(?:\\.|[^'\\])*'?)
+  | (?P<pp>^\s*\#\s*\w+)
+  | (?P<num>\b(?:0[xX][0-9a-fA-F']+|\d[\d']*(?:\.\d*)?(?:[eE][+-]?\d+)?)[uUlLfF]*\b)
+  | (?P<kw>\b(?:""" + "|".join(C_KEYWORDS) + r""")\b)
+""", re.VERBOSE)
+C_COMMENT_END_RE = re.compile(r".*?\*/")
+
+def highlight_line(code, in_comment=False):
+    # Trả về (HTML đã escape, còn đang trong comment /* */ hay không)
+    out = []
+    pos = 0
+    if in_comment:
+        end = C_COMMENT_END_RE.match(code)
+        pos = end.end() if end else len(code)
+        out.append(f"<span class='tok-com'>{html.escape(code[:pos])}</span>")
+        in_comment = end is None
+        if in_comment:
+            return "".join(out), True
+    for match in C_TOKEN_RE.finditer(code, pos):
+        if match.start() > pos:
+            out.append(html.escape(code[pos:match.start()]))
+        kind = match.lastgroup
+        text = match.group()
+        out.append(f"<span class='tok-{kind}'>{html.escape(text)}</span>")
+        if kind == 'com' and text.startswith('/*') and not (len(text) > 3 and text.endswith('*/')):
+            in_comment = True
+        pos = match.end()
+    out.append(html.escape(code[pos:]))
+    return "".join(out), in_comment
+
+def source_digest(lines):
+    digest = hashlib.sha1(HIGHLIGHT_VERSION.encode('ascii'))
+    for line in lines:
+        digest.update(line[3].encode('utf-8', 'surrogateescape'))
+        digest.update(b'\n')
+    return digest.hexdigest()
 
-        i += 1
+def prune_highlight_cache(max_bytes=HIGHLIGHT_CACHE_MAX_BYTES):
+    try:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(HIGHLIGHT_CACHE_DIR) if entry.is_file()]
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def highlighted_lines(lines):
+    # Sinh từng dòng HTML đã tô màu; đọc từ cache nếu cùng nội dung đã được tokenize trước đó
+    cache_file = os.path.join(HIGHLIGHT_CACHE_DIR, source_digest(lines) + ".txt")
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            try:
+                # Cập nhật mtime để prune_highlight_cache giữ lại mục vừa dùng
+                os.utime(cache_file)
+            except OSError:
+                pass
+            for cached in f:
+                yield cached[:-1]
+        return
+    except OSError:
+        pass
+
+    os.makedirs(HIGHLIGHT_CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file}.tmp-{os.getpid()}"
+    complete = False
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            in_comment = False
+            for line in lines:
+                code_html, in_comment = highlight_line(line[3], in_comment)
+                f.write(code_html + '\n')
+                yield code_html
+        complete = True
+    finally:
+        if complete:
+            os.replace(tmp_file, cache_file)
+        else:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+
+# ========================
+# Model → HTML (giao diện chuyên nghiệp)
+# ========================
+def heat_level(count_str, max_count):
+    # Thang log: 1 lần chạy ở mức 1, dòng chạy nhiều nhất file ở mức HEAT_LEVELS
+    hits = line_hits(count_str)
+    if max_count <= 0 or hits <= 0:
+        return 0
+    return 1 + int(math.log1p(hits) / math.log1p(max_count) * (HEAT_LEVELS - 1))
+
+def render_line_html(index, line_num_str, count_str, code, heat=0, code_html=None):
+    is_covered = line_hits(count_str) > 0
+    is_uncovered = count_str in UNEXECUTED_COUNTS
+
+    code = html.escape(code) if code_html is None else code_html
+    line_num_str = html.escape(line_num_str)
+    count_str_display = html.escape(count_str).ljust(8)
+
+    if count_str == '-':
+        css_class = 'uninstrumented'
+    elif is_uncovered:
+        css_class = 'uncovered'
+    else:
+        css_class = 'covered'
+
+    prefix = ""
+    if is_uncovered:
+        prefix = "[MISS] "
+    elif is_covered:
+        prefix = f"[{count_str_display.strip()}x] "
+
+    heat_attr = f" data-heat='{heat}'" if heat else ""
+    return f"<span class='{css_class}' data-line='{index}'{heat_attr}><span class='line-num'>{line_num_str}</span> {prefix}{code}</span>"
+
+def miss_ranges(lines):
+    # Danh sách phẳng [đầu, cuối, loại, ...] theo vị trí dòng; loại 0 = chưa chạy, 1 = nhánh chạy thiếu
+    ranges = []
+    for row, line in enumerate(lines):
+        count_str, branch_taken, branch_total = line[2], line[4], line[5]
+        if count_str in UNEXECUTED_COUNTS:
+            kind = 0
+        elif count_str != '-' and (count_str.endswith('*') or branch_taken < branch_total):
+            kind = 1
+        else:
+            continue
+        if ranges and ranges[-1] == kind and ranges[-2] == row - 1:
+            ranges[-2] = row
+        else:
+            ranges.extend((row, row, kind))
+    return ranges
+
+# Điều hướng giữa các vùng miss; cần rowElement(row) trả về span của dòng (nạp chunk nếu cần)
+MISS_NAV_SCRIPT = '''
+            const missCounter = document.getElementById('missCounter');
+            const missCount = missRanges.length / 3;
+            let currentMiss = -1;
+            let highlightedRows = [];
+
+            function showMiss(index) {
+                if (missCount === 0) return;
+                currentMiss = (index + missCount) % missCount;
+                const start = missRanges[currentMiss * 3];
+                const end = missRanges[currentMiss * 3 + 1];
+                const kind = missRanges[currentMiss * 3 + 2];
+                highlightedRows.forEach(el => el.classList.remove('highlighted'));
+                highlightedRows = [];
+                for (let row = start; row <= end; row++) {
+                    const el = rowElement(row);
+                    el.classList.add('highlighted');
+                    highlightedRows.push(el);
+                }
+                highlightedRows[0].scrollIntoView({ behavior: 'smooth', block: 'center' });
+                missCounter.textContent = (kind ? 'Partial ' : 'Miss ') + (currentMiss + 1) + ' of ' + missCount;
+            }
+
+            missCounter.textContent = missCount ? missCount + ' misses' : 'No misses';
+            document.getElementById('nextUncovered').addEventListener('click', () => showMiss(currentMiss + 1));
+            document.getElementById('prevUncovered').addEventListener('click', () => showMiss(currentMiss - 1));
+'''
+
+# Cờ trong tuple [lineNo, count, flags, text] của trang lazy-load; bit 3 trở lên là mức heat
+LINE_UNINSTRUMENTED = 1
+LINE_UNCOVERED = 2
+LINE_HTML = 4
+LINE_HEAT_SHIFT = 3
+
+def line_tuple(line_num_str, count_str, code, heat=0, code_html=None):
+    flags = heat << LINE_HEAT_SHIFT
+    if count_str == '-':
+        flags |= LINE_UNINSTRUMENTED
+    elif count_str in UNEXECUTED_COUNTS:
+        flags |= LINE_UNCOVERED
+    count = line_hits(count_str)
+    if code_html is not None:
+        flags |= LINE_HTML
+        code = code_html
+    return [int(line_num_str) if line_num_str.isdigit() else line_num_str, count, flags, code]
+
+def encode_line_tuples(tuples):
+    # '<' được escape để chuỗi "</script>" trong mã nguồn không đóng thẻ script
+    return ",".join(json.dumps(item, ensure_ascii=False, separators=(',', ':')) for item in tuples).replace('<', '\\u003c')
+
+def render_context_panel(model):
+    # "covered by": bitset hex của từng dòng, giải mã bằng BigInt khi rê chuột qua dòng
+    contexts = model.get('contexts')
+    if contexts is None:
+        return ""
+    labels = model['context_labels']
+    file_bits = 0
+    for bits in contexts.values():
+        file_bits |= bits
+    data = json.dumps({
+        'labels': labels,
+        'lines': {str(line_no): format(bits, 'x') for line_no, bits in contexts.items()},
+    }, ensure_ascii=False, separators=(',', ':')).replace('<', '\\u003c')
+    summary = html.escape(", ".join(context_names(labels, file_bits)) or "(none)")
+    return f'''
+        <div class="context-info" id="contextInfo">File covered by: {summary}</div>
+        <script type="application/json" id="context-data">{data}</script>
+        <script>
+            (() => {{
+                const contextData = JSON.parse(document.getElementById('context-data').textContent);
+                const info = document.getElementById('contextInfo');
+                document.addEventListener('mouseover', (event) => {{
+                    const span = event.target.closest('.covered, .uncovered, .uninstrumented');
+                    if (!span || !span.querySelector('.line-num')) return;
+                    const lineNo = span.querySelector('.line-num').textContent;
+                    const hex = contextData.lines[lineNo];
+                    const bits = hex ? BigInt('0x' + hex) : 0n;
+                    const names = contextData.labels.filter((label, i) => (bits >> BigInt(i)) & 1n);
+                    info.textContent = 'Line ' + lineNo + ' covered by: ' + (names.length ? names.join(', ') : '(none)');
+                }});
+            }})();
+        </script>
+'''
 
+def iter_gcov_html(model, relative_path="", highlight=False):
+    gcov_file = model['gcov_file']
+    covered = model['covered']
+    total_instrumented = model['total']
+    branch_taken = model['branch_taken']
+    branch_total = model['branch_total']
+    branch_percent = model['branch_percent']
     coverage_percent = (covered / total_instrumented * 100) if total_instrumented > 0 else 0.0
-    if branch_total > 0:
-        branch_percent = (branch_taken / branch_total * 100)
+
+    hot_lines = model.get('hot_lines')
+    max_count = hot_lines[0][0] if hot_lines else 0
+    lines = model['lines']
+    code_html = highlighted_lines(lines) if highlight else itertools.repeat(None)
+    # Sinh HTML từng dòng theo nhu cầu; trang được ghi theo từng chunk thay vì dựng cả chuỗi
+    # code_html đứng trước trong zip để generator tô màu chạy hết và ghi cache
+    use_lazy_load = len(lines) > LAZY_LOAD_THRESHOLD
+    if use_lazy_load:
+        line_items = (line_tuple(*line[1:4], heat_level(line[2], max_count), code)
+                     for code, line in zip(code_html, lines))
+    else:
+        line_items = (render_line_html(*line[:4], heat_level(line[2], max_count), code)
+                     for code, line in zip(code_html, lines))
+    heat_css = "\n".join(
+        f"        body.heatmap [data-heat='{level}'] {{ background: rgba(255, {190 - level * 18}, 0, {0.08 + level * 0.06:.2f}); }}"
+        for level in range(1, HEAT_LEVELS + 1)
+    )
+    ranges_json = json.dumps(miss_ranges(model['lines']), separators=(',', ':'))
+    context_html = render_context_panel(model)
 
     display_file_name = os.path.basename(gcov_file)
     if display_file_name.endswith('.gcov'):
@@ -154,8 +722,6 @@ def gcov_to_html(gcov_file, html_file, relative_path=""):
     breadcrumb_parts.append(html.escape(display_file_name))
     breadcrumb = " > ".join(breadcrumb_parts)
 
-    use_lazy_load = len(parsed_lines) > LAZY_LOAD_THRESHOLD
-
     # 🎨 GIAO DIỆN CHUYÊN NGHIỆP - CSS HIỆN ĐẠI
     html_content = f'''
 <!DOCTYPE html>
@@ -241,6 +807,24 @@ def gcov_to_html(gcov_file, html_file, relative_path=""):
             background: #ffc44d;
         }}
 
+        .context-info {{
+            padding: 12px 40px;
+            background: #f8f9fa;
+            border-bottom: 1px solid var(--border);
+            font-size: 0.9rem;
+        }}
+
+        body.dark-mode .context-info {{
+            background: #2d2d2d;
+            border-color: #3a3a3a;
+        }}
+
+        .miss-counter {{
+            align-self: center;
+            font-size: 0.9rem;
+            opacity: 0.9;
+        }}
+
         h1 {{
             font-size: 2rem;
             margin-bottom: 10px;
@@ -336,6 +920,13 @@ def gcov_to_html(gcov_file, html_file, relative_path=""):
         .covered {{ color: #a6e22e; }}
         .uncovered {{ color: #f92672; background: rgba(249, 38, 114, 0.1); }}
         .uninstrumented {{ color: #666; }}
+        .highlighted {{ outline: 1px solid var(--warning); background: rgba(255, 209, 102, 0.15); }}
+        .tok-kw {{ color: #66d9ef; }}
+        .tok-str {{ color: #e6db74; }}
+        .tok-com {{ color: #75715e; font-style: italic; }}
+        .tok-num {{ color: #ae81ff; }}
+        .tok-pp {{ color: #fd971f; }}
+{heat_css}
 
         .line-num {{
             color: #666;
@@ -397,6 +988,9 @@ def gcov_to_html(gcov_file, html_file, relative_path=""):
         <header>
             <div class="actions">
                 <button class="btn btn-dark-mode" id="themeToggle">🌙 Dark Mode</button>
+                <button class="btn btn-dark-mode" id="heatToggle">🔥 Heatmap</button>
+                <span class="miss-counter" id="missCounter"></span>
+                <button class="btn btn-next" id="prevUncovered">⏮️ Prev</button>
                 <button class="btn btn-next" id="nextUncovered">⏭️ Next Uncovered</button>
             </div>
             <div class="breadcrumb">{breadcrumb}</div>
@@ -422,43 +1016,59 @@ def gcov_to_html(gcov_file, html_file, relative_path=""):
                 </div>
             </div>
         </header>
-
+{context_html}
         <a href="index.html" class="back-link">⬅️ Back to Summary</a>
 
 '''
 
+    yield html_content
+
     if use_lazy_load:
-        html_content += '''
+        yield '''
         <div id="coverage-container"></div>
         <div id="loader">Loading more lines... ▼</div>
 
-        <script>
-            const allLines = [
-'''
-        for item in parsed_lines:
-            html_content += f'                `{item["html"]}`,\n'
+        <script type="application/json" id="coverage-data">['''
+        separator = ''
+        for chunk in iter(lambda: list(itertools.islice(line_items, CHUNK_SIZE)), []):
+            yield separator + encode_line_tuples(chunk)
+            separator = ','
 
-        html_content = html_content.rstrip(',\n') + '''
-            ];
+        yield ''']</script>
 
+        <script>
+            const allLines = JSON.parse(document.getElementById('coverage-data').textContent);
             const container = document.getElementById('coverage-container');
             const loader = document.getElementById('loader');
             let loadedCount = 0;
             const chunkSize = ''' + str(CHUNK_SIZE) + ''';
-            let uncoveredSpans = [];
-            let currentIndex = -1;
+            const missRanges = ''' + ranges_json + ''';
+
+            // [lineNo, count, flags, text]: flags 1 = không đo, 2 = chưa chạy, 4 = text là HTML đã tô màu, >> 3 = heat
+            function buildLine(line) {
+                const [lineNo, count, flags, text] = line;
+                const span = document.createElement('span');
+                span.className = flags & 1 ? 'uninstrumented' : flags & 2 ? 'uncovered' : 'covered';
+                if (flags >> 3) span.dataset.heat = flags >> 3;
+                const num = document.createElement('span');
+                num.className = 'line-num';
+                num.textContent = lineNo;
+                span.appendChild(num);
+                const prefix = flags & 2 ? '[MISS] ' : !(flags & 1) && count > 0 ? '[' + count + 'x] ' : '';
+                span.appendChild(document.createTextNode(' ' + prefix));
+                if (flags & 4) {
+                    span.insertAdjacentHTML('beforeend', text);
+                } else {
+                    span.appendChild(document.createTextNode(text));
+                }
+                return span;
+            }
 
             function loadChunk() {
                 const fragment = document.createDocumentFragment();
                 const end = Math.min(loadedCount + chunkSize, allLines.length);
                 for (let i = loadedCount; i < end; i++) {
-                    const div = document.createElement('div');
-                    div.innerHTML = allLines[i];
-                    const span = div.firstChild;
-                    if (span.classList.contains('uncovered')) {
-                        uncoveredSpans.push(span);
-                    }
-                    fragment.appendChild(span);
+                    fragment.appendChild(buildLine(allLines[i]));
                 }
                 container.appendChild(fragment);
                 loadedCount = end;
@@ -478,86 +1088,250 @@ def gcov_to_html(gcov_file, html_file, relative_path=""):
                 }
             });
 
-            document.getElementById('nextUncovered').addEventListener('click', () => {
-                if (uncoveredSpans.length === 0) return;
-                currentIndex = (currentIndex + 1) % uncoveredSpans.length;
-                const target = uncoveredSpans[currentIndex];
-                uncoveredSpans.forEach(el => el.classList.remove('highlighted'));
-                target.classList.add('highlighted');
-                target.scrollIntoView({ behavior: 'smooth', block: 'center' });
-            });
-
-            setTimeout(() => {
-                const firstUncovered = document.querySelector('.uncovered');
-                if (firstUncovered) {
-                    firstUncovered.scrollIntoView({ behavior: 'smooth', block: 'center' });
-                    firstUncovered.classList.add('highlighted');
-                    currentIndex = uncoveredSpans.indexOf(firstUncovered);
+            function rowElement(row) {
+                while (loadedCount <= row) {
+                    loadChunk();
                 }
-            }, 100);
+                return container.children[row];
+            }
+''' + MISS_NAV_SCRIPT + '''
+            setTimeout(() => showMiss(0), 100);
 
             const toggle = document.getElementById('themeToggle');
             toggle.addEventListener('click', () => {
                 document.body.classList.toggle('dark-mode');
                 toggle.textContent = document.body.classList.contains('dark-mode') ? '☀️ Light Mode' : '🌙 Dark Mode';
             });
+
+            document.getElementById('heatToggle').addEventListener('click', () => {
+                document.body.classList.toggle('heatmap');
+            });
         </script>
 '''
 
     else:
-        html_content += '''
+        yield '''
         <pre>
 '''
-        for item in parsed_lines:
-            html_content += item['html'] + '\n'
-        html_content += '''
+        for chunk in iter(lambda: list(itertools.islice(line_items, CHUNK_SIZE)), []):
+            yield ''.join(item + '\n' for item in chunk)
+        yield '''
         </pre>
 
         <script>
-            const uncoveredSpans = Array.from(document.querySelectorAll('.uncovered'));
-            let currentIndex = -1;
-
-            document.getElementById('nextUncovered').addEventListener('click', () => {
-                if (uncoveredSpans.length === 0) return;
-                currentIndex = (currentIndex + 1) % uncoveredSpans.length;
-                const target = uncoveredSpans[currentIndex];
-                uncoveredSpans.forEach(el => el.classList.remove('highlighted'));
-                target.classList.add('highlighted');
-                target.scrollIntoView({ behavior: 'smooth', block: 'center' });
-            });
+            const missRanges = ''' + ranges_json + ''';
+            const codeRows = document.querySelector('pre').children;
 
-            window.addEventListener('load', () => {
-                const firstUncovered = document.querySelector('.uncovered');
-                if (firstUncovered) {
-                    firstUncovered.scrollIntoView({ behavior: 'smooth', block: 'center' });
-                    firstUncovered.classList.add('highlighted');
-                    currentIndex = 0;
-                }
-            });
+            function rowElement(row) {
+                return codeRows[row];
+            }
+''' + MISS_NAV_SCRIPT + '''
+            window.addEventListener('load', () => showMiss(0));
 
             const toggle = document.getElementById('themeToggle');
             toggle.addEventListener('click', () => {
                 document.body.classList.toggle('dark-mode');
                 toggle.textContent = document.body.classList.contains('dark-mode') ? '☀️ Light Mode' : '🌙 Dark Mode';
             });
+
+            document.getElementById('heatToggle').addEventListener('click', () => {
+                document.body.classList.toggle('heatmap');
+            });
         </script>
 '''
 
-    html_content += '''
+    yield '''
     </div>
 </body>
 </html>
 '''
 
+def render_gcov_html(model, relative_path="", highlight=False):
+    return ''.join(iter_gcov_html(model, relative_path, highlight))
+
+# ========================
+# Ghi file HTML bằng thread nền: render đẩy chunk vào hàng đợi có giới hạn, thread ghi ra đĩa
+# ========================
+class PendingFile:
+    def __init__(self, path, channel, on_done=None):
+        self.path = path
+        self.tmp_path = f"{path}.tmp-{os.getpid()}"
+        self.channel = channel
+        self.on_done = on_done
+        self.file = None
+        self.error = None
+        self.cancelled = False
+
+class BackgroundWriter:
+    # Mỗi file gắn với một thread ghi (round-robin) để các chunk giữ đúng thứ tự; nhiều file được ghi cùng
+    # lúc trên các thread khác nhau. finish() không chờ: close() ghi hết mọi file đang dở rồi trả về tổng kết
+    def __init__(self, threads=WRITE_THREADS):
+        self.lock = threading.Lock()
+        self.write_time = 0.0
+        self.written = 0
+        self.failures = []
+        self.channels = [queue.Queue(WRITE_QUEUE_CHUNKS) for _ in range(threads)]
+        self.next_channel = itertools.cycle(self.channels)
+        self.threads = [threading.Thread(target=self._run, args=(channel,), daemon=True)
+                        for channel in self.channels]
+        for thread in self.threads:
+            thread.start()
+
+    def open(self, path, on_done=None):
+        # on_done được gọi trên thread ghi sau khi file đã nằm đúng chỗ (os.replace xong)
+        return PendingFile(path, next(self.next_channel), on_done)
+
+    def write(self, pending, chunk):
+        # Trả về thời gian chờ khi hàng đợi đầy (backpressure)
+        start = time.perf_counter()
+        pending.channel.put((pending, chunk))
+        return time.perf_counter() - start
+
+    def finish(self, pending, cancel=False):
+        # Đánh dấu hết file (cancel: bỏ file tạm) rồi trả về ngay; trả về thời gian chờ hàng đợi
+        pending.cancelled = cancel
+        return self.write(pending, None)
+
+    def close(self):
+        # Chờ mọi file đang dở ghi xong; trả về {'write', 'bytes', 'failures': [đường dẫn]}
+        for channel in self.channels:
+            channel.put(None)
+        for thread in self.threads:
+            thread.join()
+        return {'write': self.write_time, 'bytes': self.written, 'failures': self.failures}
+
+    def _run(self, channel):
+        while True:
+            item = channel.get()
+            if item is None:
+                return
+            pending, chunk = item
+            if pending.error is not None:
+                continue
+            if chunk is None and pending.cancelled:
+                self._discard(pending)
+                continue
+            start = time.perf_counter()
+            written = 0
+            try:
+                if pending.file is None:
+                    pending.file = open(pending.tmp_path, 'w', encoding='utf-8')
+                if chunk is not None:
+                    pending.file.write(chunk)
+                else:
+                    written = pending.file.tell()
+                    f, pending.file = pending.file, None
+                    f.close()
+                    os.replace(pending.tmp_path, pending.path)
+            except Exception as e:
+                pending.error = e
+                self._discard(pending)
+                log_event('error', 'write_error', f"[ERROR] Ghi file HTML thất bại: {e}", file=pending.path,
+                          error=str(e))
+            with self.lock:
+                self.write_time += time.perf_counter() - start
+                self.written += written
+                if pending.error is not None:
+                    self.failures.append(pending.path)
+            if chunk is None and pending.error is None and pending.on_done:
+                pending.on_done()
+
+    def _discard(self, pending):
+        if pending.file is not None:
+            f, pending.file = pending.file, None
+            try:
+                f.close()
+            except Exception:
+                pass
+        try:
+            os.remove(pending.tmp_path)
+        except OSError:
+            pass
+
+WRITER = None
+WRITER_PID = None
+
+def get_writer():
+    # Một writer cho mỗi tiến trình (worker của pool tạo writer riêng sau khi fork)
+    global WRITER, WRITER_PID
+    if WRITER is None or WRITER_PID != os.getpid():
+        WRITER = BackgroundWriter()
+        WRITER_PID = os.getpid()
+    return WRITER
+
+def close_writer():
+    # Ghi hết các trang đang dở của tiến trình này; trả về tổng kết ghi (kèm pid để gộp vào profile)
+    global WRITER
+    summary = {'worker': os.getpid(), 'write': 0.0, 'bytes': 0, 'failures': []}
+    if WRITER is None or WRITER_PID != os.getpid():
+        return summary
+    summary.update(WRITER.close())
+    WRITER = None
+    return summary
+
+def log_page_written(model, html_file):
+    coverage_percent = (model['covered'] / model['total'] * 100) if model['total'] > 0 else 0.0
+    status = " (lazy-load)" if len(model['lines']) > LAZY_LOAD_THRESHOLD else ""
+    log_event(LOG_CONFIG['file_level'], 'file',
+              f"[OK] {model['gcov_file']} → {os.path.basename(html_file)} | C0: {coverage_percent:.1f}% | C1: {model['branch_percent']:.1f}%{status}",
+              file=model['gcov_file'], html=os.path.basename(html_file), c0=round(coverage_percent, 2),
+              c1=round(model['branch_percent'], 2), lazy=bool(status))
+
+def write_gcov_html(model, html_file, relative_path="", stats=None, highlight=False, writer=None):
+    # Không có writer: ghi đồng bộ, trả về False nếu lỗi. Có writer: trang được xếp hàng cho thread ghi,
+    # render trang kế tiếp chạy song song; lỗi ghi và số byte được tổng kết ở close_writer()
+    start = time.perf_counter()
+    wait_time = 0.0
     try:
-        with open(html_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        status = " (lazy-load)" if use_lazy_load else ""
-        print(f"[OK] {gcov_file} → {os.path.basename(html_file)} | C0: {coverage_percent:.1f}% | C1: {branch_percent:.1f}%{status}")
+        if writer is None:
+            # Ghi vào file tạm rồi os.replace: chế độ watch ghi thẳng vào báo cáo đang được xem
+            write_time = 0.0
+            tmp_path = f"{html_file}.tmp-{os.getpid()}"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for chunk in iter_gcov_html(model, relative_path, highlight):
+                        chunk_start = time.perf_counter()
+                        f.write(chunk)
+                        write_time += time.perf_counter() - chunk_start
+                    written = f.tell()
+                os.replace(tmp_path, html_file)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            if stats is not None:
+                stats['render'] += time.perf_counter() - start - write_time
+                stats['write'] += write_time
+                stats['bytes'] += written
+            log_page_written(model, html_file)
+            return True
+
+        pending = writer.open(html_file, lambda: log_page_written(model, html_file))
+        try:
+            for chunk in iter_gcov_html(model, relative_path, highlight):
+                wait_time += writer.write(pending, chunk)
+                if pending.error is not None:
+                    break
+        except BaseException:
+            writer.finish(pending, cancel=True)
+            raise
+        wait_time += writer.finish(pending)
+        if stats is not None:
+            stats['render'] += time.perf_counter() - start - wait_time
+            stats['write_wait'] += wait_time
+        return True
     except Exception as e:
-        print(f"[ERROR] Ghi file HTML thất bại: {e}")
+        log_event('error', 'write_error', f"[ERROR] Ghi file HTML thất bại: {e}", file=html_file, error=str(e))
+        return False
 
-    return covered, total_instrumented, branch_percent
+def gcov_to_html(gcov_file, html_file, relative_path=""):
+    model = parse_gcov(gcov_file)
+    if model is None:
+        return 0, 0, 0.0
+    write_gcov_html(model, html_file, relative_path)
+    return model['covered'], model['total'], model['branch_percent']
 
 # ========================
 # Tạo cấu trúc cây thư mục
@@ -639,7 +1413,7 @@ def render_tree_to_html(tree, level=0):
 # ========================
 # Tạo trang index.html (giao diện chuyên nghiệp)
 # ========================
-def generate_index_html(reports):
+def index_totals(reports):
     total_covered = sum(r['covered'] for r in reports)
     total_instrumented = sum(r['total'] for r in reports)
     total_branch_taken = sum(r.get('branch_taken', 0) for r in reports)
@@ -647,6 +1421,175 @@ def generate_index_html(reports):
 
     overall_c0 = (total_covered / total_instrumented * 100) if total_instrumented > 0 else 0
     overall_c1 = (total_branch_taken / total_branch_total * 100) if total_branch_total > 0 else 0
+    return total_covered, total_instrumented, total_branch_taken, total_branch_total, overall_c0, overall_c1
+
+def project_hotspots(reports, limit=HOTSPOT_LIMIT):
+    # Gộp top N của từng file bằng heap giới hạn N
+    lines = heapq.nlargest(limit, (
+        (count, report['relative_path'], line_no, code, report['html_file'])
+        for report in reports for count, line_no, code in report.get('hot_lines', ())
+    ))
+    functions = heapq.nlargest(limit, (
+        (called, name, report['relative_path'], line_no, report['html_file'])
+        for report in reports for called, name, line_no in report.get('hot_functions', ())
+    ))
+    return lines, functions
+
+def render_hotspots_html(reports):
+    lines, functions = project_hotspots(reports)
+    if not lines and not functions:
+        return ""
+    line_rows = "\n".join(
+        f"                <tr><td class='hot-count'>{count:,}</td><td><a href='{html.escape(html_file)}'>{html.escape(path)}</a>:{html.escape(line_no)}</td><td><code>{html.escape(code)}</code></td></tr>"
+        for count, path, line_no, code, html_file in lines
+    )
+    function_rows = "\n".join(
+        f"                <tr><td class='hot-count'>{called:,}</td><td><code>{html.escape(name)}</code></td><td><a href='{html.escape(html_file)}'>{html.escape(path)}</a>:{html.escape(line_no)}</td></tr>"
+        for called, name, path, line_no, html_file in functions
+    )
+    return f'''
+        <h2 class="section-title">🔥 Hotspots</h2>
+        <div class="hotspots">
+            <table>
+                <tr><th>Executions</th><th>Line</th><th>Code</th></tr>
+{line_rows}
+            </table>
+            <table>
+                <tr><th>Calls</th><th>Function</th><th>Location</th></tr>
+{function_rows}
+            </table>
+        </div>
+'''
+
+# Bảng file phẳng: cột (khoá sắp xếp) theo thứ tự hiển thị; thứ tự sắp xếp được tính sẵn khi sinh trang
+FILE_TABLE_COLUMNS = ('path', 'c0', 'c1', 'lines', 'misses', 'functions')
+FILE_TABLE_ROW_HEIGHT = 30
+
+def file_table_rows(reports):
+    # [path, html_file, c0, c1, lines, misses, functions_called, functions_total]
+    rows = []
+    for report in sorted(reports, key=lambda r: _to_posix(r['relative_path']).lower()):
+        c0 = (report['covered'] / report['total'] * 100) if report['total'] > 0 else 0.0
+        rows.append([_to_posix(report['relative_path']), report['html_file'], round(c0, 2),
+                     round(report.get('branch_percent', 0), 2), report['total'], report['total'] - report['covered'],
+                     report.get('function_called', 0), report.get('function_total', 0)])
+    return rows
+
+def file_table_orders(rows):
+    # Chỉ số hàng theo thứ tự tăng dần của từng cột; hàng đã sắp theo path nên sort ổn định giữ path làm khoá phụ
+    keys = {
+        'c0': lambda i: rows[i][2],
+        'c1': lambda i: rows[i][3],
+        'lines': lambda i: rows[i][4],
+        'misses': lambda i: rows[i][5],
+        'functions': lambda i: (rows[i][7], rows[i][6]),
+    }
+    orders = {'path': list(range(len(rows)))}
+    for column, key in keys.items():
+        orders[column] = sorted(range(len(rows)), key=key)
+    return orders
+
+def render_file_table_html(reports):
+    rows = file_table_rows(reports)
+    data = json.dumps({'rows': rows, 'orders': file_table_orders(rows)}, ensure_ascii=False,
+                      separators=(',', ':')).replace('<', '\\u003c')
+    headers = "".join(f'<div class="ft-cell ft-{column}" data-sort="{column}">{label}</div>'
+                      for column, label in zip(FILE_TABLE_COLUMNS, ('Path', 'C0', 'C1', 'Lines', 'Misses', 'Functions')))
+    return f'''
+        <h2 class="section-title">📋 All Files</h2>
+        <div class="file-table">
+            <div class="ft-row ft-header">{headers}</div>
+            <div class="ft-scroll" id="fileTableScroll">
+                <div class="ft-spacer" id="fileTableSpacer"></div>
+            </div>
+        </div>
+        <script type="application/json" id="file-table-data">{data}</script>
+'''
+
+FILE_TABLE_SCRIPT = '''
+        // Bảng ảo: chỉ dựng các hàng trong vùng nhìn thấy; sắp xếp chỉ đổi mảng chỉ số đã tính sẵn
+        const fileTable = JSON.parse(document.getElementById('file-table-data').textContent);
+        const tableScroll = document.getElementById('fileTableScroll');
+        const tableSpacer = document.getElementById('fileTableSpacer');
+        const ROW_HEIGHT = %(row_height)d;
+        let sortColumn = 'path';
+        let sortDescending = false;
+        let tableFilter = '';
+        let tableView = fileTable.orders.path;
+        let tableFrame = 0;
+
+        function badgeClass(percent) {
+            return percent >= 80 ? 'badge-success' : percent >= 50 ? 'badge-warning' : 'badge-danger';
+        }
+
+        function tableRow(index, position) {
+            const row = fileTable.rows[index];
+            const div = document.createElement('div');
+            div.className = 'ft-row';
+            div.style.top = (position * ROW_HEIGHT) + 'px';
+            const link = document.createElement('a');
+            link.href = row[1];
+            link.textContent = row[0];
+            const path = document.createElement('div');
+            path.className = 'ft-cell ft-path';
+            path.title = row[0];
+            path.appendChild(link);
+            div.appendChild(path);
+            const cells = [[row[2].toFixed(1) + '%%', 'ft-c0 ' + badgeClass(row[2])],
+                           [row[3].toFixed(1) + '%%', 'ft-c1 ' + badgeClass(row[3])],
+                           [row[4].toLocaleString(), 'ft-lines'],
+                           [row[5].toLocaleString(), 'ft-misses'],
+                           [row[6] + ' / ' + row[7], 'ft-functions']];
+            for (const [text, className] of cells) {
+                const cell = document.createElement('div');
+                cell.className = 'ft-cell ' + className;
+                cell.textContent = text;
+                div.appendChild(cell);
+            }
+            return div;
+        }
+
+        function renderTable() {
+            tableFrame = 0;
+            const first = Math.max(0, Math.floor(tableScroll.scrollTop / ROW_HEIGHT) - 10);
+            const last = Math.min(tableView.length, first + Math.ceil(tableScroll.clientHeight / ROW_HEIGHT) + 20);
+            const fragment = document.createDocumentFragment();
+            fragment.appendChild(tableSpacer);
+            for (let position = first; position < last; position++) {
+                const index = sortDescending ? tableView[tableView.length - 1 - position] : tableView[position];
+                fragment.appendChild(tableRow(index, position));
+            }
+            tableScroll.replaceChildren(fragment);
+        }
+
+        function scheduleTable() {
+            if (!tableFrame) tableFrame = requestAnimationFrame(renderTable);
+        }
+
+        function updateTableView() {
+            const order = fileTable.orders[sortColumn];
+            tableView = tableFilter ? order.filter(index => fileTable.rows[index][0].toLowerCase().includes(tableFilter)) : order;
+            tableSpacer.style.height = (tableView.length * ROW_HEIGHT) + 'px';
+            scheduleTable();
+        }
+
+        document.querySelectorAll('.ft-header [data-sort]').forEach(header => {
+            header.addEventListener('click', () => {
+                const column = header.dataset.sort;
+                sortDescending = column === sortColumn ? !sortDescending : false;
+                sortColumn = column;
+                document.querySelectorAll('.ft-header [data-sort]').forEach(h => h.removeAttribute('data-dir'));
+                header.dataset.dir = sortDescending ? 'desc' : 'asc';
+                updateTableView();
+            });
+        });
+        tableScroll.addEventListener('scroll', scheduleTable);
+        window.addEventListener('resize', scheduleTable);
+        updateTableView();
+''' % {'row_height': FILE_TABLE_ROW_HEIGHT}
+
+def generate_index_html(reports):
+    total_covered, total_instrumented, _, _, overall_c0, overall_c1 = index_totals(reports)
 
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     save_history({
@@ -659,9 +1602,24 @@ def generate_index_html(reports):
     })
 
     history = load_history()
-    if len(history) > 1:
-        last_c0 = history[-2]['overall_c0']
-        last_c1 = history[-2]['overall_c1']
+    previous = history[-2] if len(history) > 1 else None
+    html_content = render_index_html(reports, previous, now)
+
+    with open(build_path(os.path.basename(INDEX_FILE)), 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+    log_event('info', 'summary', f"\n✅ [TỔNG KẾT] C0: {overall_c0:.1f}% | C1: {overall_c1:.1f}%",
+              c0=round(overall_c0, 2), c1=round(overall_c1, 2), files=len(reports))
+    log_event('info', 'index', f"📁 Mở file: {os.path.abspath(INDEX_FILE)} để xem báo cáo!",
+              index=os.path.abspath(INDEX_FILE))
+
+def render_index_html(reports, previous=None, now=None):
+    total_covered, total_instrumented, total_branch_taken, total_branch_total, overall_c0, overall_c1 = index_totals(reports)
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    if previous:
+        last_c0 = previous['overall_c0']
+        last_c1 = previous['overall_c1']
         delta_c0 = overall_c0 - last_c0
         delta_c1 = overall_c1 - last_c1
         trend_c0 = f" <span style='color: {'green' if delta_c0 > 0 else 'red'};'>{'▲' if delta_c0 > 0 else '▼'}{abs(delta_c0):.1f}%</span>" if delta_c0 != 0 else ""
@@ -672,6 +1630,8 @@ def generate_index_html(reports):
     tree = build_tree(reports)
     tree_html_lines = render_tree_to_html(tree)
     tree_html = "\n".join(tree_html_lines)
+    hotspots_html = render_hotspots_html(reports)
+    file_table_html = render_file_table_html(reports)
 
     html_content = f'''
 <!DOCTYPE html>
@@ -813,6 +1773,104 @@ def generate_index_html(reports):
             padding: 0 40px 40px;
         }}
 
+        .hotspots {{
+            padding: 0 40px 40px;
+            display: grid;
+            gap: 30px;
+        }}
+
+        .hotspots table {{
+            width: 100%;
+            border-collapse: collapse;
+            font-size: 0.9rem;
+        }}
+
+        .hotspots th, .hotspots td {{
+            padding: 6px 10px;
+            border-bottom: 1px solid var(--border);
+            text-align: left;
+        }}
+
+        .hotspots code {{
+            font-family: 'Fira Code', 'Consolas', monospace;
+            white-space: pre;
+        }}
+
+        .hot-count {{
+            font-weight: 700;
+            text-align: right;
+            white-space: nowrap;
+        }}
+
+        .file-table {{
+            margin: 0 40px 40px;
+            border: 1px solid var(--border);
+            border-radius: 8px;
+            overflow: hidden;
+            font-size: 0.9rem;
+        }}
+
+        .ft-scroll {{
+            position: relative;
+            height: {FILE_TABLE_ROW_HEIGHT * 16}px;
+            overflow-y: auto;
+        }}
+
+        .ft-row {{
+            display: flex;
+            height: {FILE_TABLE_ROW_HEIGHT}px;
+            line-height: {FILE_TABLE_ROW_HEIGHT}px;
+            border-bottom: 1px solid var(--border);
+        }}
+
+        .ft-scroll .ft-row {{
+            position: absolute;
+            left: 0;
+            right: 0;
+        }}
+
+        .ft-header {{
+            background: var(--light);
+            font-weight: 600;
+            cursor: pointer;
+            user-select: none;
+        }}
+
+        .ft-header [data-dir="asc"]::after {{ content: " ▲"; }}
+        .ft-header [data-dir="desc"]::after {{ content: " ▼"; }}
+
+        .ft-cell {{
+            flex: 0 0 110px;
+            padding: 0 10px;
+            text-align: right;
+            white-space: nowrap;
+        }}
+
+        .ft-cell.ft-path {{
+            flex: 1 1 auto;
+            min-width: 0;
+            overflow: hidden;
+            text-overflow: ellipsis;
+            text-align: left;
+        }}
+
+        .ft-path a {{
+            color: var(--primary);
+            text-decoration: none;
+        }}
+
+        .ft-scroll .badge-success {{ color: #06a77d; }}
+        .ft-scroll .badge-warning {{ color: #c99700; }}
+        .ft-scroll .badge-danger {{ color: var(--danger); }}
+
+        body.dark-mode .ft-header {{
+            background: #252525;
+        }}
+
+        body.dark-mode .file-table, body.dark-mode .ft-row {{
+            border-color: #3a3a3a;
+        }}
+
         .btn-dark-mode {{
             position: fixed;
             top: 20px;
@@ -902,6 +1960,8 @@ def generate_index_html(reports):
         <div id="fileTree">
 {tree_html}
         </div>
+{file_table_html}
+{hotspots_html}
     </div>
 
     <script>
@@ -918,60 +1978,2628 @@ def generate_index_html(reports):
                 const text = item.textContent.toLowerCase();
                 item.style.display = text.includes(term) ? '' : 'none';
             }});
+            tableFilter = term;
+            updateTableView();
         }});
+{FILE_TABLE_SCRIPT}
     </script>
 </body>
 </html>
 '''
+    return html_content
 
-    with open(INDEX_FILE, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+# ========================
+# Tìm file .gcov (os.scandir, không dùng glob đệ quy)
+# ========================
+def _to_posix(path):
+    return path.replace(os.sep, '/')
+
+def _match_any(path, patterns):
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+def _scan_tree(root, match, skip, prune):
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            log_event('warning', 'scan_error', f"[WARN] Bỏ qua thư mục {current}: {e}", path=current, error=str(e))
+            continue
+
+        subdirs = []
+        with entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith('.'):
+                    continue
+                path = name if current == '.' else os.path.join(current, name)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if name not in prune and not _match_any(_to_posix(path), skip):
+                            subdirs.append(path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                rel = _to_posix(path)
+                if _match_any(rel, match) and not _match_any(rel, skip):
+                    yield path
+
+        stack.extend(reversed(subdirs))
+
+def read_file_list(source):
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def discover_gcov_files(roots=('.',), match=('*.gcov',), skip=(), prune=DEFAULT_PRUNE_DIRS, files_from=None):
+    seen = set()
+    if files_from:
+        candidates = (os.path.normpath(p) for p in read_file_list(files_from))
+        candidates = (p for p in candidates
+                      if _match_any(_to_posix(p), match) and not _match_any(_to_posix(p), skip))
+    else:
+        candidates = (p for root in roots for p in _scan_tree(os.path.normpath(root), match, skip, prune))
 
-    print(f"\n✅ [TỔNG KẾT] C0: {overall_c0:.1f}% | C1: {overall_c1:.1f}%")
-    print(f"📁 Mở file: {os.path.abspath(INDEX_FILE)} để xem báo cáo!")
+    for path in candidates:
+        if path not in seen:
+            seen.add(path)
+            yield path
 
 # ========================
-# Main
+# Lọc theo header "Source:" (trước khi parse)
 # ========================
-def main():
-    gcov_files = glob.glob("**/*.gcov", recursive=True)
-    if not gcov_files:
-        print("[!] Không tìm thấy file .gcov nào.")
-        print("→ Hãy chạy `gcov -b your_file.c` để sinh file .gcov")
-        sys.exit(1)
+def read_gcov_source(gcov_file):
+    try:
+        with open(gcov_file, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                parts = line.split(':', 3)
+                if len(parts) < 3 or parts[1].strip() != '0':
+                    break
+                if parts[2] == 'Source' and len(parts) == 4:
+                    return parts[3].strip()
+    except OSError:
+        pass
+    return None
+
+def gcov_source_path(gcov_file, source):
+    # Source: tương đối được tính từ thư mục chứa file .gcov, trả về đường dẫn theo thư mục hiện tại
+    # để các .gcov ở những thư mục build khác nhau nhưng cùng một file nguồn cho cùng một khoá
+    if os.path.isabs(source):
+        return os.path.normpath(source)
+    full_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(gcov_file)), source))
+    try:
+        return os.path.relpath(full_path)
+    except ValueError:
+        return full_path
+
+def filters_by_source(source_filter):
+    # Chỉ khi có --include/--exclude/--source-root mới cần đọc trước header để bỏ file trước khi parse;
+    # việc bỏ header bên ngoài được làm sau khi parse, dựa trên model['source']
+    return bool(source_filter and (source_filter.get('root') or source_filter.get('include')
+                                   or source_filter.get('exclude')))
+
+def resolve_source(source, source_filter, base_dir=None):
+    # Source: tương đối trong .gcov là tương đối với thư mục build (nơi chạy gcov, chứa file .gcov)
+    root = source_filter.get('root')
+    posix_source = _to_posix(source)
+    is_external = posix_source.startswith(EXTERNAL_PREFIXES)
+
+    if root:
+        root = os.path.abspath(root)
+        full_path = os.path.normpath(os.path.join(os.path.abspath(base_dir) if base_dir is not None else root,
+                                                  source))
+        try:
+            rel = os.path.relpath(full_path, root)
+        except ValueError:
+            rel = full_path
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep) or os.path.isabs(rel):
+            is_external = True
+            rel = full_path
+    else:
+        rel = os.path.normpath(source)
 
-    reports = []
+    if is_external and not source_filter.get('keep_external'):
+        return None
+
+    rel_posix = _to_posix(rel)
+    include = source_filter.get('include')
+    if include and not _match_any(rel_posix, include):
+        return None
+    if _match_any(rel_posix, source_filter.get('exclude', ())):
+        return None
+    return rel
+
+# ========================
+# Đọc LCOV / Cobertura làm đầu vào (stream, không dựng DOM)
+# ========================
+def _merge_record(records, source, hits, branches, functions):
+    record = records.get(source)
+    if record is None:
+        records[source] = {'source': source, 'hits': hits, 'branches': branches, 'functions': functions}
+        return
+    for line_no, count in hits.items():
+        record['hits'][line_no] = record['hits'].get(line_no, 0) + count
+    for line_no, (taken, total) in branches.items():
+        old_taken, old_total = record['branches'].get(line_no, (0, 0))
+        record['branches'][line_no] = (max(taken, old_taken), max(total, old_total))
+    if functions:
+        # Cùng một hàm xuất hiện ở nhiều shard/test: cộng số lần gọi thay vì lặp lại
+        known = {(name, line_no): index for index, (name, line_no, _) in enumerate(record['functions'])}
+        for name, line_no, called in functions:
+            index = known.get((name, line_no))
+            if index is None:
+                known[(name, line_no)] = len(record['functions'])
+                record['functions'].append((name, line_no, called))
+            else:
+                record['functions'][index] = (name, line_no, record['functions'][index][2] + called)
+
+def read_lcov(path):
+    # Trả về từng bản ghi SF...end_of_record; việc gộp theo source do merge_records làm
+    source = None
+    hits, branches, fn_lines, fn_hits = {}, {}, {}, {}
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            tag, _, value = line.partition(':')
+            if tag == 'SF':
+                source = value.strip()
+                hits, branches, fn_lines, fn_hits = {}, {}, {}, {}
+            elif tag == 'DA':
+                fields = value.split(',')
+                if len(fields) >= 2 and fields[0].isdigit():
+                    line_no = int(fields[0])
+                    count = int(fields[1]) if fields[1].lstrip('-').isdigit() else 0
+                    hits[line_no] = hits.get(line_no, 0) + max(count, 0)
+            elif tag == 'BRDA':
+                fields = value.split(',')
+                if len(fields) >= 4 and fields[0].isdigit():
+                    line_no = int(fields[0])
+                    taken, total = branches.get(line_no, (0, 0))
+                    is_taken = fields[3] not in ('-', '0')
+                    branches[line_no] = (taken + (1 if is_taken else 0), total + 1)
+            elif tag == 'FN':
+                # lcov 1.x: FN:<line>,<name>; lcov 2.x: FN:<start>,<end>,<name>
+                fields = value.split(',')
+                if fields[0].isdigit():
+                    fn_lines[fields[-1]] = fields[0]
+            elif tag == 'FNDA':
+                count, _, name = value.partition(',')
+                name, called = function_record(name, count)
+                fn_hits[name] = called
+            elif line == 'end_of_record' and source is not None:
+                functions = [(name, line_no, fn_hits.get(name, 0)) for name, line_no in fn_lines.items()]
+                yield {'source': source, 'hits': hits, 'branches': branches, 'functions': functions}
+                source = None
+
+def _parse_condition(condition):
+    # "50% (1/2)" → (1, 2)
+    if '(' in condition and '/' in condition:
+        taken, _, total = condition[condition.index('(') + 1:].rstrip(')').partition('/')
+        if taken.isdigit() and total.isdigit():
+            return int(taken), int(total)
+    return None
+
+def read_cobertura(path):
+    # <sources> đứng trước <packages> nên đã đủ khi gặp <class> đầu tiên
+    sources = []
+    for event, elem in ElementTree.iterparse(path, events=('end',)):
+        if elem.tag == 'source':
+            if elem.text and elem.text.strip():
+                sources.append(elem.text.strip())
+        elif elem.tag == 'class':
+            filename = elem.get('filename', '')
+            hits, branches, functions = {}, {}, []
+            lines = elem.find('lines')
+            for line in (lines if lines is not None else ()):
+                number = line.get('number', '')
+                if not number.isdigit():
+                    continue
+                line_no = int(number)
+                count = line.get('hits', '0')
+                hits[line_no] = hits.get(line_no, 0) + (int(count) if count.isdigit() else 0)
+                if line.get('branch') == 'true':
+                    condition = _parse_condition(line.get('condition-coverage', ''))
+                    if condition:
+                        branches[line_no] = condition
+            methods = elem.find('methods')
+            for method in (methods if methods is not None else ()):
+                first = method.find('lines/line')
+                if first is not None:
+                    name, called = function_record(method.get('name', ''), first.get('hits', '0'))
+                    functions.append((name, first.get('number', '0'), called))
+            elem.clear()
+            if filename:
+                yield {'source': filename, 'hits': hits, 'branches': branches, 'functions': functions,
+                       'search_dirs': sources}
+        elif elem.tag == 'package':
+            elem.clear()
+
+def iter_tracefile_records(lcov_inputs=(), cobertura_inputs=(), memory_limit=None):
+    def records():
+        for path in lcov_inputs:
+            yield from read_lcov(path)
+        for path in cobertura_inputs:
+            yield from read_cobertura(path)
+    if not lcov_inputs and not cobertura_inputs:
+        return iter(())
+    return merge_records(records(), memory_limit)
+
+# ========================
+# Gộp bản ghi của nhiều shard trong giới hạn bộ nhớ (--memory-limit): tràn ra file tạm rồi merge ngoài
+# ========================
+# Ước lượng bộ nhớ cho mỗi mục hits/branches/functions trong dict Python (khoá, giá trị, slot của dict)
+RECORD_ENTRY_BYTES = 160
+# Merge k-way giữ một bản ghi mỗi run; nhiều run hơn thì merge trước từng nhóm thành run lớn hơn
+MERGE_FANIN = 16
+
+def parse_size(spec):
+    units = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*', spec, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"dung lượng không hợp lệ: {spec!r} (vd. 512M, 4G)")
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+def record_size(record):
+    return (len(record['hits']) + len(record['branches']) + len(record['functions']) + 1) * RECORD_ENTRY_BYTES
+
+def spill_records(records, path):
+    # Một run đã sắp xếp theo source, mỗi dòng một bản ghi JSON
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps([record['source'], record.get('search_dirs', []), list(record['hits'].items()),
+                                [(line_no, taken, total) for line_no, (taken, total) in record['branches'].items()],
+                                record['functions']], ensure_ascii=False, separators=(',', ':')) + '\n')
+    return path
+
+def read_spilled(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            source, search_dirs, hits, branches, functions = json.loads(line)
+            yield source, {
+                'source': source,
+                'hits': dict(hits),
+                'branches': {line_no: (taken, total) for line_no, taken, total in branches},
+                'functions': [tuple(function) for function in functions],
+                'search_dirs': search_dirs,
+            }
+
+def merge_runs(paths):
+    pending = None
+    for source, record in heapq.merge(*(read_spilled(path) for path in paths), key=lambda item: item[0]):
+        if pending is not None and pending['source'] != source:
+            yield pending
+            pending = None
+        if pending is None:
+            pending = record
+        else:
+            _merge_record({source: pending}, source, record['hits'], record['branches'], record['functions'])
+    if pending is not None:
+        yield pending
+
+def merge_records(records, memory_limit=None):
+    # Gộp trong bộ nhớ; khi vượt ngân sách, ghi các bản ghi đang giữ thành run đã sắp xếp và merge k-way ở cuối
+    merged = {}
+    used = 0
+    runs = []
+    spill_dir = None
+    try:
+        for record in records:
+            current = merged.get(record['source'])
+            _merge_record(merged, record['source'], record['hits'], record['branches'], record['functions'])
+            if current is None and 'search_dirs' in record:
+                merged[record['source']]['search_dirs'] = record['search_dirs']
+            used += record_size(record)
+            if memory_limit and used > memory_limit:
+                if spill_dir is None:
+                    spill_dir = tempfile.mkdtemp(prefix='gcov2html-spill-')
+                runs.append(spill_records((merged[source] for source in sorted(merged)),
+                                          os.path.join(spill_dir, f"run-{len(runs):05d}.jsonl")))
+                log_event('debug', 'spill', f"[..] Vượt --memory-limit: ghi {len(merged)} bản ghi ra {runs[-1]}",
+                          path=runs[-1], records=len(merged), estimated=used)
+                merged = {}
+                used = 0
+        if not runs:
+            yield from merged.values()
+            return
+        if merged:
+            runs.append(spill_records((merged[source] for source in sorted(merged)),
+                                      os.path.join(spill_dir, f"run-{len(runs):05d}.jsonl")))
+            merged = {}
+        log_event('info', 'spill', f"[..] Gộp {len(runs)} run đã tràn ra đĩa (--memory-limit)", runs=len(runs))
+
+        merged_runs = 0
+        while len(runs) > MERGE_FANIN:
+            group, runs = runs[:MERGE_FANIN], runs[MERGE_FANIN:]
+            runs.append(spill_records(merge_runs(group), os.path.join(spill_dir, f"merged-{merged_runs:05d}.jsonl")))
+            merged_runs += 1
+            for path in group:
+                os.remove(path)
+        yield from merge_runs(runs)
+    finally:
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+def _open_source_text(source, search_dirs=(), source_root=None):
+    candidates = [source] if os.path.isabs(source) else [
+        os.path.join(base, source) for base in [*search_dirs, source_root or '.']]
+    for candidate in candidates:
+        try:
+            with open(candidate, 'r', encoding='utf-8', errors='ignore') as f:
+                return f.read().splitlines()
+        except OSError:
+            continue
+    return []
+
+def model_from_record(record, source_root=None):
+    hits = record['hits']
+    branches = record['branches']
+    text = record.get('text') or _open_source_text(record['source'], record.get('search_dirs', ()), source_root)
+    last_line = max(len(text), max(hits, default=0))
+
+    parsed_lines = []
+    hot_lines = []
+    covered = 0
+    for line_no in range(1, last_line + 1):
+        code = text[line_no - 1] if line_no <= len(text) else ''
+        if line_no in hits:
+            count_str = str(hits[line_no]) if hits[line_no] > 0 else '#####'
+            if hits[line_no] > 0:
+                covered += 1
+                push_hotspot(hot_lines, (hits[line_no], str(line_no), code.strip()[:HOTSPOT_CODE_WIDTH]))
+        else:
+            count_str = '-'
+        taken, total = branches.get(line_no, (0, 0))
+        parsed_lines.append((line_no - 1, str(line_no), count_str, code, taken, total))
+
+    hot_functions = []
+    for name, line_no, called in record['functions']:
+        push_hotspot(hot_functions, (called, name, str(line_no)))
+
+    branch_taken = sum(taken for taken, _ in branches.values())
+    branch_total = sum(total for _, total in branches.values())
+    return {
+        'gcov_file': record['source'],
+        'source': record['source'],
+        'lines': parsed_lines,
+        'functions': [(name, str(line_no), called) for name, line_no, called in record['functions']],
+        'hot_lines': sorted(hot_lines, reverse=True),
+        'hot_functions': sorted(hot_functions, reverse=True),
+        'covered': covered,
+        'total': len(hits),
+        'branch_taken': branch_taken,
+        'branch_total': branch_total,
+        'branch_percent': (branch_taken / branch_total * 100) if branch_total > 0 else 0.0,
+    }
 
+# ========================
+# Header dùng chung (gcov -p / -l): gom các file .gcov mangled theo Source:
+# ========================
+def is_mangled(gcov_file):
+    # -l: "foo.c##util.h.gcov"; -p: '/' thành '#', '..' thành '^'
+    return '#' in os.path.basename(gcov_file)
+
+def demangle_gcov_name(gcov_file):
+    name = os.path.basename(gcov_file)[:-5].rpartition('##')[2]
+    return '/'.join('..' if part == '^' else part for part in name.split('#'))
+
+def header_key(gcov_file):
+    source = read_gcov_source(gcov_file)
+    if source:
+        return gcov_source_path(gcov_file, source)
+    return os.path.normpath(demangle_gcov_name(gcov_file))
+
+def consolidate_headers(gcov_files):
+    # File thường đi thẳng vào pool; file mangled được giữ lại tới cuối để gom đủ mọi translation unit
+    groups = {}
     for gcov_file in gcov_files:
-        relative_dir = os.path.dirname(gcov_file)
-        html_filename = gcov_file.replace('.gcov', '.html').replace(os.sep, '_')
-        html_file = os.path.join(OUTPUT_DIR, html_filename)
-
-        covered, total, branch_percent = gcov_to_html(gcov_file, html_file, relative_dir)
-        if total > 0:
-            base_name = os.path.basename(gcov_file)
-            if base_name.endswith('.gcov'):
-                display_name = base_name[:-5]
+        if is_mangled(gcov_file):
+            groups.setdefault(header_key(gcov_file), []).append(gcov_file)
+        else:
+            yield gcov_file
+    for source, members in groups.items():
+        yield {'source': source, 'gcov_files': sorted(members)}
+
+def load_header_group(group):
+    # Cộng dồn số đếm của mọi translation unit; mã nguồn chỉ decode ở file đầu tiên
+    records = {}
+    called = {}
+    text = None
+    for gcov_file in group['gcov_files']:
+        model = parse_gcov(gcov_file, text is None)
+        if model is None:
+            continue
+        _, hits, branches, functions, model_text = record_from_model(model)
+        for name, line_no, count in functions:
+            called[(name, line_no)] = called.get((name, line_no), 0) + count
+        if text is None:
+            text = model_text
+        _merge_record(records, group['source'], hits, branches, [])
+    record = records.get(group['source'])
+    if record is None:
+        return None
+    record['functions'] = [(name, line_no, count) for (name, line_no), count in called.items()]
+    record['text'] = text
+    return model_from_record(record)
+
+def regroup_headers(headers, changed, removed):
+    # --watch: dựng lại nhóm của các header có file thành viên thay đổi hoặc bị xoá
+    touched = set()
+    for path in removed:
+        for key, members in headers.items():
+            if path in members:
+                members.discard(path)
+                touched.add(key)
+    for path in changed:
+        key = header_key(path)
+        headers.setdefault(key, set()).add(path)
+        touched.add(key)
+    return [{'source': key, 'gcov_files': sorted(headers[key])} for key in touched]
+
+# ========================
+# Ngữ cảnh test: mỗi nhãn là một thư mục .gcov (một test hoặc shard)
+# ========================
+def parse_context(spec):
+    label, sep, directory = spec.partition('=')
+    if not sep or not label or not directory:
+        raise argparse.ArgumentTypeError(f"ngữ cảnh không hợp lệ: {spec!r} (dạng LABEL=DIR)")
+    return label, directory
+
+def discover_context_groups(contexts, match=None, skip=(), prune=DEFAULT_PRUNE_DIRS):
+    # Gom các file .gcov của mọi ngữ cảnh theo source (đọc header Source:)
+    labels = [label for label, _ in contexts]
+    groups = {}
+    for index, (_, directory) in enumerate(contexts):
+        for gcov_file in discover_gcov_files([directory], match, skip, prune):
+            source = read_gcov_source(gcov_file)
+            if source is None:
+                source = os.path.normpath(_to_posix(os.path.relpath(gcov_file, directory))[:-5])
             else:
-                display_name = base_name
-
-            reports.append({
-                'name': display_name,
-                'covered': covered,
-                'total': total,
-                'branch_percent': branch_percent,
-                'html_file': html_filename,
-                'relative_path': gcov_file.replace('.gcov', '')
+                source = gcov_source_path(gcov_file, source)
+            group = groups.get(source)
+            if group is None:
+                group = groups[source] = {'source': source, 'labels': labels, 'contexts': []}
+            group['contexts'].append((index, gcov_file))
+    return list(groups.values())
+
+def record_from_model(model):
+    hits = {}
+    branches = {}
+    text = []
+    for _, line_num_str, count_str, code, taken, total in model['lines']:
+        if not line_num_str.isdigit() or line_num_str == '0':
+            continue
+        line_no = int(line_num_str)
+        if len(text) < line_no:
+            text.extend([''] * (line_no - len(text)))
+        text[line_no - 1] = code
+        if count_str != '-':
+            hits[line_no] = line_hits(count_str)
+        if total:
+            branches[line_no] = (taken, total)
+    functions = [(name, int(line_num_str) if line_num_str.isdigit() else 0, called)
+                 for name, line_num_str, called in model['functions']]
+    return model['source'] or model['gcov_file'], hits, branches, functions, text
+
+def load_context_group(group):
+    # Cộng dồn số đếm của mọi ngữ cảnh; mỗi dòng được chạy giữ một bitset int (bit i = ngữ cảnh i)
+    records = {}
+    contexts = {}
+    called = {}
+    text = []
+    for index, gcov_file in group['contexts']:
+        model = parse_gcov(gcov_file)
+        if model is None:
+            continue
+        _, hits, branches, functions, model_text = record_from_model(model)
+        for line_no, count in hits.items():
+            if count > 0:
+                contexts[line_no] = contexts.get(line_no, 0) | (1 << index)
+        for name, line_no, count in functions:
+            called[(name, line_no)] = called.get((name, line_no), 0) + count
+        if len(model_text) > len(text):
+            text = model_text
+        _merge_record(records, group['source'], hits, branches, [])
+    record = records.get(group['source'])
+    if record is None:
+        return None
+    record['functions'] = [(name, line_no, count) for (name, line_no), count in called.items()]
+    record['text'] = text
+    model = model_from_record(record)
+    model['contexts'] = contexts
+    model['context_labels'] = group['labels']
+    return model
+
+def context_names(labels, bits):
+    return [label for index, label in enumerate(labels) if bits >> index & 1]
+
+def save_contexts(labels, files):
+    # Bitset ghi dạng hex để giữ nguyên khi số ngữ cảnh vượt 53 bit của số JSON
+    with open(build_path(os.path.basename(CONTEXTS_FILE)), 'w', encoding='utf-8') as f:
+        json.dump({
+            'labels': labels,
+            'files': {path: {str(line_no): format(bits, 'x') for line_no, bits in sorted(lines.items())}
+                      for path, lines in files.items()},
+        }, f, ensure_ascii=False)
+
+def query_contexts(query, path=CONTEXTS_FILE):
+    # FILE:LINE → các ngữ cảnh chạy dòng đó; FILE → số dòng mỗi ngữ cảnh chạy; LABEL → các dòng ngữ cảnh đó chạy
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        log_event('error', 'context_error', f"[ERROR] Không đọc được {path}: {e}", path=path, error=str(e))
+        return 1
+    labels = data['labels']
+    files = data['files']
+
+    if query in labels:
+        index = labels.index(query)
+        for file_path, lines in files.items():
+            hit = [int(line_no) for line_no, bits in lines.items() if int(bits, 16) >> index & 1]
+            if hit:
+                print(f"{file_path}: {', '.join(map(str, sorted(hit)))}")
+        return 0
+
+    file_path, _, line_no = query.rpartition(':')
+    if not line_no.isdigit():
+        file_path, line_no = query, None
+    file_path = _to_posix(os.path.normpath(file_path))
+    lines = files.get(file_path)
+    if lines is None:
+        log_event('error', 'context_not_found', f"[!] Không có dữ liệu ngữ cảnh cho {query}", query=query)
+        return 1
+    if line_no is not None:
+        names = context_names(labels, int(lines.get(line_no, '0'), 16))
+        print(f"{file_path}:{line_no} covered by: {', '.join(names) if names else '(none)'}")
+        return 0
+    for index, label in enumerate(labels):
+        count = sum(1 for bits in lines.values() if int(bits, 16) >> index & 1)
+        print(f"{label}: {count} dòng")
+    return 0
+
+# ========================
+# Xử lý từng file (chạy trong worker)
+# ========================
+def export_lines(model):
+    # Chỉ giữ dữ liệu đếm (không có mã nguồn) để gửi về tiến trình chính
+    rows = []
+    for _, line_num_str, count_str, _, taken, total in model['lines']:
+        if count_str == '-' or not line_num_str.isdigit():
+            continue
+        rows.append((int(line_num_str), line_hits(count_str), taken, total))
+    return rows
+
+def describe_gcov(gcov_file, source_filter=None):
+    relative_dir = os.path.dirname(gcov_file)
+    relative_path = gcov_file.replace('.gcov', '')
+    html_filename = gcov_file.replace('.gcov', '.html').replace(os.sep, '_')
+
+    base_name = os.path.basename(gcov_file)
+    if base_name.endswith('.gcov'):
+        display_name = base_name[:-5]
+    else:
+        display_name = base_name
+
+    if filters_by_source(source_filter):
+        source = read_gcov_source(gcov_file)
+        if source:
+            source_rel = resolve_source(source, source_filter, os.path.dirname(gcov_file))
+        else:
+            source_rel = resolve_source(relative_path, source_filter)
+        if source_rel is None:
+            return None
+        if source_filter.get('root'):
+            relative_path = source_rel
+            relative_dir = os.path.dirname(source_rel)
+            display_name = os.path.basename(source_rel)
+
+    return {
+        'input': gcov_file,
+        'name': display_name,
+        'html_file': html_filename,
+        'relative_path': relative_path,
+        'relative_dir': relative_dir,
+    }
+
+def describe_record(record, source_filter=None):
+    # Nhóm header/ngữ cảnh mang Source: đã được gcov_source_path quy về thư mục hiện tại
+    base_dir = os.getcwd() if 'gcov_files' in record or 'contexts' in record else None
+    source_rel = resolve_source(record['source'], source_filter or {}, base_dir)
+    if source_rel is None:
+        return None
+    return {
+        'input': record,
+        'name': os.path.basename(source_rel),
+        'html_file': source_rel.replace(os.sep, '_').replace(':', '_') + '.html',
+        'relative_path': source_rel,
+        'relative_dir': os.path.dirname(source_rel),
+    }
+
+def describe_input(item, source_filter=None):
+    # Đầu vào là đường dẫn .gcov, bản ghi đã đọc từ LCOV/Cobertura hoặc nhóm .gcov (theo ngữ cảnh / header)
+    if isinstance(item, dict):
+        return describe_record(item, source_filter)
+    return describe_gcov(item, source_filter)
+
+def load_model(entry, source_filter=None, decode_source=True):
+    if isinstance(entry['input'], dict) and 'contexts' in entry['input']:
+        return load_context_group(entry['input'])
+    if isinstance(entry['input'], dict) and 'gcov_files' in entry['input']:
+        return load_header_group(entry['input'])
+    if isinstance(entry['input'], dict):
+        return model_from_record(entry['input'], (source_filter or {}).get('root'))
+    model = parse_gcov(entry['input'], decode_source)
+    if model is not None and source_filter and not filters_by_source(source_filter):
+        # Không đọc trước header: bỏ header hệ thống/bên ngoài sau khi parse
+        if model['source']:
+            source_rel = resolve_source(model['source'], source_filter, os.path.dirname(entry['input']))
+        else:
+            source_rel = resolve_source(entry['relative_path'], source_filter)
+        if source_rel is None:
+            return None
+    return model
+
+def process_input(item, options=None):
+    options = options or {}
+    configure_logging(options.get('log'))
+    set_build_dir(options.get('build_dir'))
+    source_filter = options.get('source_filter')
+    entry = describe_input(item, source_filter)
+    if entry is None:
+        return None
+
+    stats = new_stage_stats()
+    start = time.perf_counter()
+    # Chỉ cần mã nguồn khi render trang HTML
+    model = load_model(entry, source_filter, options.get('render', True) or bool(options.get('patch')))
+    stats['parse'] = time.perf_counter() - start
+    if model is None:
+        return None
+    return finish_report(model, entry, options, stats)
+
+def new_stage_stats():
+    return {'worker': os.getpid(), 'parse': 0.0, 'render': 0.0, 'write': 0.0, 'write_wait': 0.0, 'lines': 0,
+            'bytes': 0}
+
+def finish_report(model, entry, options, stats=None):
+    source_filter = options.get('source_filter')
+    written = True
+    if options.get('render', True):
+        written = write_gcov_html(model, build_path(entry['html_file']), entry['relative_dir'], stats,
+                                  options.get('highlight', False), get_writer())
+    if model['total'] <= 0:
+        return None
+
+    relative_path = entry['relative_path']
+    report = {
+        'name': entry['name'],
+        'covered': model['covered'],
+        'total': model['total'],
+        'branch_taken': model['branch_taken'],
+        'branch_total': model['branch_total'],
+        'branch_percent': model['branch_percent'],
+        'html_file': entry['html_file'],
+        'relative_path': relative_path,
+        'hot_lines': model['hot_lines'],
+        'hot_functions': model['hot_functions'],
+        'function_called': sum(1 for _, _, called in model['functions'] if called > 0),
+        'function_total': len(model['functions']),
+    }
+    if not written:
+        report['write_error'] = True
+    if 'contexts' in model:
+        report['contexts'] = model['contexts']
+    if options.get('patch'):
+        intervals = patch_intervals(options['patch'], model['source'] or relative_path)
+        if intervals:
+            report['patch'] = patch_lines(model, intervals)
+    if isinstance(entry['input'], str):
+        report['input'] = entry['input']
+        report['stamp'] = file_stamp(entry['input'])
+    elif 'gcov_files' in entry['input']:
+        report['inputs'] = entry['input']['gcov_files']
+    if options.get('collect'):
+        if source_filter and source_filter.get('root'):
+            report['source'] = _to_posix(relative_path)
+        else:
+            report['source'] = _to_posix(model['source'] or relative_path)
+        report['lines'] = export_lines(model)
+        report['functions'] = model['functions']
+    if stats is not None:
+        stats['lines'] = len(model['lines'])
+        report['stats'] = stats
+    return report
+
+WORKER_BARRIER = None
+
+def init_worker(barrier):
+    global WORKER_BARRIER
+    WORKER_BARRIER = barrier
+
+def drain_worker():
+    # Mỗi worker nhận đúng một tác vụ này: barrier giữ nó lại tới khi mọi worker cùng đang drain
+    WORKER_BARRIER.wait()
+    return close_writer()
+
+def run_reports(inputs, jobs, options=None, on_report=None, progress=None, on_written=None):
+    # on_written nhận tổng kết ghi của từng tiến trình (close_writer) sau khi mọi trang đã ghi xong
+    found = 0
+    done = 0
+    reports = []
+
+    def handle(report):
+        nonlocal done
+        done += 1
+        if progress:
+            progress(done, found)
+        if not report:
+            return
+        if on_report:
+            on_report(report)
+        # Dữ liệu từng dòng đã được exporter ghi ra, không giữ lại trong bộ nhớ
+        report.pop('lines', None)
+        report.pop('functions', None)
+        report.pop('stats', None)
+        reports.append(report)
+
+    if jobs <= 1:
+        for item in inputs:
+            found += 1
+            handle(process_input(item, options))
+        written = close_writer()
+        if on_written:
+            on_written(written)
+        if progress:
+            progress(done, found, final=True)
+        return found, reports
+
+    # Gửi file vào pool ngay khi tìm thấy để parse chạy song song với việc quét thư mục;
+    # giới hạn số kết quả đang chờ để bộ nhớ không tăng theo kích thước dự án.
+    max_pending = jobs * 4
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(multiprocessing.Barrier(jobs),)) as pool:
+        pending = deque()
+        for item in inputs:
+            found += 1
+            pending.append(pool.submit(process_input, item, options))
+            while len(pending) > max_pending:
+                handle(pending.popleft().result())
+        while pending:
+            handle(pending.popleft().result())
+        # Trang được ghi nền trong từng worker: drain tất cả trước khi tắt pool
+        for future in [pool.submit(drain_worker) for _ in range(jobs)]:
+            written = future.result()
+            if on_written:
+                on_written(written)
+    if progress:
+        progress(done, found, final=True)
+    return found, reports
+
+# ========================
+# Chế độ --check: chỉ parse + tổng hợp, không sinh HTML
+# ========================
+def parse_threshold(spec):
+    # Dạng "C0[:C1]" hoặc "DIR=C0[:C1]"
+    directory, _, values = spec.rpartition('=')
+    c0_str, _, c1_str = values.partition(':')
+    try:
+        min_c0 = float(c0_str) if c0_str else None
+        min_c1 = float(c1_str) if c1_str else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ngưỡng không hợp lệ: {spec!r} (dạng DIR=C0[:C1])")
+    directory = _to_posix(os.path.normpath(directory)) if directory else ''
+    return ('' if directory == '.' else directory), min_c0, min_c1
+
+def find_threshold(relative_path, thresholds):
+    path = _to_posix(relative_path)
+    best = None
+    for directory, min_c0, min_c1 in thresholds:
+        if directory and path != directory and not path.startswith(directory + '/'):
+            continue
+        if best is None or len(directory) > len(best[0]):
+            best = (directory, min_c0, min_c1)
+    return best
+
+def check_reports(reports, thresholds):
+    failures = []
+    for report in reports:
+        rule = find_threshold(report['relative_path'], thresholds)
+        if rule is None:
+            continue
+        _, min_c0, min_c1 = rule
+        c0 = (report['covered'] / report['total'] * 100) if report['total'] > 0 else 0.0
+        c1 = report['branch_percent']
+        # File không có nhánh nào thì không có gì để đo C1: không tính là dưới ngưỡng
+        c1_failed = min_c1 is not None and report.get('branch_total', 0) > 0 and c1 < min_c1
+        if (min_c0 is not None and c0 < min_c0) or c1_failed:
+            failures.append({
+                'file': _to_posix(report['relative_path']),
+                'c0': round(c0, 2),
+                'c1': round(c1, 2),
+                'min_c0': min_c0,
+                'min_c1': min_c1,
             })
 
-    if reports:
-        generate_index_html(reports)
-        # try:
-        #     webbrowser.open('file://' + os.path.abspath(INDEX_FILE))
-        # except:
-        #     print(f"🌐 Mở thủ công: {os.path.abspath(INDEX_FILE)}")
+    total_covered = sum(r['covered'] for r in reports)
+    total_instrumented = sum(r['total'] for r in reports)
+    total_branch_taken = sum(r.get('branch_taken', 0) for r in reports)
+    total_branch_total = sum(r.get('branch_total', 0) for r in reports)
+    overall_c0 = (total_covered / total_instrumented * 100) if total_instrumented > 0 else 0.0
+    overall_c1 = (total_branch_taken / total_branch_total * 100) if total_branch_total > 0 else 0.0
+
+    overall_failed = False
+    global_rule = find_threshold('', [t for t in thresholds if not t[0]])
+    if global_rule:
+        _, min_c0, min_c1 = global_rule
+        overall_failed = ((min_c0 is not None and overall_c0 < min_c0)
+                          or (min_c1 is not None and total_branch_total > 0 and overall_c1 < min_c1))
+
+    return {
+        'passed': not failures and not overall_failed,
+        'files': len(reports),
+        'overall': {'c0': round(overall_c0, 2), 'c1': round(overall_c1, 2), 'failed': overall_failed},
+        'failures': sorted(failures, key=lambda f: f['file']),
+    }
+
+def print_check_summary(summary, output_format):
+    if output_format == 'json':
+        print(json.dumps(summary, ensure_ascii=False))
+        return
+
+    for failure in summary['failures']:
+        expected = []
+        if failure['min_c0'] is not None:
+            expected.append(f"C0>={failure['min_c0']:g}%")
+        if failure['min_c1'] is not None:
+            expected.append(f"C1>={failure['min_c1']:g}%")
+        print(f"[FAIL] {failure['file']} | C0: {failure['c0']:.1f}% | C1: {failure['c1']:.1f}% (cần {', '.join(expected)})")
+
+    overall = summary['overall']
+    status = "PASS" if summary['passed'] else "FAIL"
+    print(f"[{status}] {summary['files']} file | C0: {overall['c0']:.1f}% | C1: {overall['c1']:.1f}% | "
+          f"{len(summary['failures'])} file dưới ngưỡng{' | tổng dưới ngưỡng' if overall['failed'] else ''}")
+
+# ========================
+# Patch coverage (--diff): chỉ tính các dòng được thêm/sửa trong unified diff
+# ========================
+HUNK_RE = re.compile(r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def _merge_intervals(line_numbers):
+    intervals = []
+    for line_no in sorted(line_numbers):
+        if intervals and line_no <= intervals[-1][1] + 1:
+            intervals[-1][1] = max(intervals[-1][1], line_no)
+        else:
+            intervals.append([line_no, line_no])
+    return intervals
+
+def _diff_target(line):
+    target = line[4:].rstrip('\n').split('\t', 1)[0].strip()
+    if len(target) > 1 and target[0] == target[-1] == '"':
+        target = target[1:-1]
+    if target == '/dev/null':
+        return None
+    if target.startswith(('a/', 'b/')):
+        target = target[2:]
+    return _to_posix(os.path.normpath(target))
+
+def read_unified_diff(path):
+    # {đường dẫn file mới: [[đầu, cuối], ...]} đã sắp xếp và gộp; file bị xoá (+++ /dev/null) bị bỏ qua.
+    # Số dòng còn lại của hunk được đếm theo header @@ để dòng nội dung bắt đầu bằng "+++ "/"--- " không bị
+    # nhầm với header file
+    changed = {}
+    current = None
+    new_line = 0
+    old_left = new_left = 0
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if old_left > 0 or new_left > 0:
+                tag = line[:1]
+                if tag == '\\':
+                    # "\ No newline at end of file"
+                    continue
+                if tag in ('+', '-', ' ', '\n'):
+                    if tag != '-':
+                        if tag == '+' and current is not None:
+                            current.append(new_line)
+                        new_line += 1
+                        new_left -= 1
+                    if tag != '+':
+                        old_left -= 1
+                    continue
+                # Diff bị cắt ngắn: dòng này đã là header kế tiếp
+                old_left = new_left = 0
+            if line.startswith('+++ '):
+                target = _diff_target(line)
+                current = None if target is None else changed.setdefault(target, [])
+                continue
+            match = HUNK_RE.match(line)
+            if match:
+                old_count, start, new_count = match.groups()
+                old_left = 1 if old_count is None else int(old_count)
+                new_left = 1 if new_count is None else int(new_count)
+                new_line = int(start)
+    return {file_path: _merge_intervals(lines) for file_path, lines in changed.items() if lines}
+
+def patch_intervals(patch, source):
+    # Source: của gcov có thể là tuyệt đối hoặc tương đối thư mục build nên so khớp theo đuôi đường dẫn
+    path = _to_posix(os.path.normpath(source))
+    intervals = patch.get(path)
+    if intervals is not None:
+        return intervals
+    for file_path, intervals in patch.items():
+        if path.endswith('/' + file_path) or file_path.endswith('/' + path):
+            return intervals
+    return None
+
+def in_intervals(intervals, line_no):
+    index = bisect.bisect_right(intervals, [line_no, math.inf]) - 1
+    return index >= 0 and intervals[index][1] >= line_no
+
+def patch_inputs(inputs, patch):
+    # Lọc trước khi parse: với .gcov chỉ đọc header Source:
+    for item in inputs:
+        if isinstance(item, dict):
+            source = item['source']
+        else:
+            source = read_gcov_source(item) or item[:-5]
+        if patch_intervals(patch, source) is not None:
+            yield item
+
+def patch_lines(model, intervals):
+    # Các dòng thay đổi có đo coverage: (line_no, hits, code)
+    rows = []
+    for _, line_num_str, count_str, code, _, _ in model['lines']:
+        if count_str == '-' or not line_num_str.isdigit():
+            continue
+        line_no = int(line_num_str)
+        if in_intervals(intervals, line_no):
+            rows.append((line_no, line_hits(count_str), code))
+    return rows
+
+def summarize_patch(reports, patch_files, min_patch):
+    files = []
+    changed = covered = 0
+    for report in reports:
+        rows = patch_files.get(report['html_file'])
+        if not rows:
+            continue
+        hit = sum(1 for _, hits, _ in rows if hits > 0)
+        changed += len(rows)
+        covered += hit
+        files.append({
+            'file': _to_posix(report['relative_path']),
+            'html_file': report['html_file'],
+            'changed': len(rows),
+            'covered': hit,
+            'missed': [(line_no, code) for line_no, hits, code in rows if hits == 0],
+        })
+    percent = (covered / changed * 100) if changed else 100.0
+    return {
+        'passed': percent >= min_patch,
+        'percent': round(percent, 2),
+        'covered': covered,
+        'changed': changed,
+        'min_patch': min_patch,
+        'files': sorted(files, key=lambda f: f['file']),
+    }
+
+def print_patch_summary(summary, output_format):
+    if output_format == 'json':
+        print(json.dumps({'patch': summary}, ensure_ascii=False))
+        return
+
+    for item in summary['files']:
+        if item['missed']:
+            missed = ", ".join(str(line_no) for line_no, _ in item['missed'])
+            print(f"[MISS] {item['file']} | {item['covered']}/{item['changed']} dòng thay đổi | chưa chạy: {missed}")
+    status = "PASS" if summary['passed'] else "FAIL"
+    print(f"[{status}] Patch coverage: {summary['percent']:.1f}% ({summary['covered']}/{summary['changed']} dòng "
+          f"thay đổi trong {len(summary['files'])} file, cần >= {summary['min_patch']:g}%)")
+
+def render_patch_html(summary):
+    sections = []
+    for item in summary['files']:
+        percent = item['covered'] / item['changed'] * 100
+        rows = "\n".join(
+            f"""                <tr><td class="line-num">{line_no}</td><td class="code">{html.escape(code)}</td></tr>"""
+            for line_no, code in item['missed'])
+        sections.append(f"""
+        <div class="patch-file">
+            <h3><a href="{html.escape(item['html_file'])}">{html.escape(item['file'])}</a>
+                <span class="{'ok' if not item['missed'] else 'miss'}">{percent:.1f}% ({item['covered']}/{item['changed']})</span></h3>
+            <table>
+{rows}
+            </table>
+        </div>""")
+    status = "PASS" if summary['passed'] else "FAIL"
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Patch Coverage</title>
+    <style>
+        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; color: #2b2d42; padding: 20px; }}
+        .container {{ max-width: 1200px; margin: 0 auto; background: white; border-radius: 16px; box-shadow: 0 10px 30px rgba(0,0,0,0.08); padding: 40px; }}
+        h1 {{ font-size: 2rem; margin-bottom: 10px; }}
+        .summary {{ font-size: 1.1rem; margin-bottom: 30px; }}
+        .summary a, .patch-file a {{ color: #4361ee; text-decoration: none; }}
+        .patch-file {{ margin-bottom: 25px; }}
+        .patch-file h3 {{ font-size: 1rem; margin-bottom: 8px; }}
+        .ok {{ color: #06d6a0; }}
+        .miss {{ color: #ef476f; }}
+        table {{ width: 100%; border-collapse: collapse; background: #2d2d2d; border-radius: 8px; }}
+        td {{ padding: 2px 12px; font-family: 'Fira Code', 'Consolas', monospace; font-size: 14px; white-space: pre; }}
+        .line-num {{ color: #f92672; text-align: right; width: 60px; }}
+        .code {{ color: #f8f8f2; background: rgba(239, 71, 111, 0.15); }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🩹 Patch Coverage</h1>
+        <p class="summary"><strong class="{'ok' if summary['passed'] else 'miss'}">{status}</strong>
+            {summary['percent']:.1f}% — {summary['covered']}/{summary['changed']} changed lines executed
+            (target {summary['min_patch']:g}%) · <a href="index.html">Full report</a></p>
+{''.join(sections)}
+    </div>
+</body>
+</html>
+"""
+
+# ========================
+# Xuất dữ liệu: Cobertura XML, LCOV, JSON (ghi dạng stream)
+# ========================
+def _rate(hit, total):
+    return f"{(hit / total) if total else 1.0:.4f}"
+
+class LcovExporter:
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def add(self, report):
+        out = self.file
+        out.write(f"TN:\nSF:{report['source']}\n")
+        for name, line_num_str, called in report['functions']:
+            out.write(f"FN:{line_num_str},{name}\n")
+        for name, _, called in report['functions']:
+            out.write(f"FNDA:{called},{name}\n")
+        out.write(f"FNF:{len(report['functions'])}\n")
+        out.write(f"FNH:{sum(1 for f in report['functions'] if f[2] > 0)}\n")
+        for line_no, _, taken, total in report['lines']:
+            for k in range(total):
+                out.write(f"BRDA:{line_no},0,{k},{1 if k < taken else 0}\n")
+        out.write(f"BRF:{report['branch_total']}\nBRH:{report['branch_taken']}\n")
+        out.writelines(f"DA:{line_no},{hits}\n" for line_no, hits, _, _ in report['lines'])
+        out.write(f"LF:{report['total']}\nLH:{report['covered']}\nend_of_record\n")
+
+    def close(self, reports):
+        self.file.close()
+
+class JsonSummaryExporter:
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('{"files":[')
+        self.first = True
+
+    def add(self, report):
+        entry = {
+            'file': report['source'],
+            'covered': report['covered'],
+            'total': report['total'],
+            'branch_taken': report['branch_taken'],
+            'branch_total': report['branch_total'],
+            'c0': round(report['covered'] / report['total'] * 100, 2) if report['total'] else 0.0,
+            'c1': round(report['branch_percent'], 2),
+        }
+        self.file.write(('' if self.first else ',') + json.dumps(entry, ensure_ascii=False))
+        self.first = False
+
+    def close(self, reports):
+        total_covered = sum(r['covered'] for r in reports)
+        total_instrumented = sum(r['total'] for r in reports)
+        total_branch_taken = sum(r['branch_taken'] for r in reports)
+        total_branch_total = sum(r['branch_total'] for r in reports)
+        overall = {
+            'files': len(reports),
+            'covered': total_covered,
+            'total': total_instrumented,
+            'branch_taken': total_branch_taken,
+            'branch_total': total_branch_total,
+            'c0': round(total_covered / total_instrumented * 100, 2) if total_instrumented else 0.0,
+            'c1': round(total_branch_taken / total_branch_total * 100, 2) if total_branch_total else 0.0,
+        }
+        self.file.write('],"overall":' + json.dumps(overall) + '}\n')
+        self.file.close()
+
+class CoberturaExporter:
+    # Mỗi <class> được ghi ngay vào file tạm; cuối cùng gom theo package và
+    # chép sang file đích (chỉ giữ offset trong bộ nhớ, không dựng DOM)
+    def __init__(self, path, source_root=None):
+        self.path = path
+        self.source_root = os.path.abspath(source_root or '.')
+        self.spool = tempfile.TemporaryFile()
+        self.chunks = {}
+
+    def add(self, report):
+        source = report['source']
+        package = os.path.dirname(source).replace('/', '.') or '.'
+        parts = [f'\t\t\t\t<class name={quoteattr(os.path.basename(source))} filename={quoteattr(source)} '
+                 f'line-rate="{_rate(report["covered"], report["total"])}" '
+                 f'branch-rate="{_rate(report["branch_taken"], report["branch_total"])}" complexity="0">\n'
+                 '\t\t\t\t\t<methods>\n']
+        for name, line_num_str, called in report['functions']:
+            parts.append(f'\t\t\t\t\t\t<method name={quoteattr(name)} signature="" '
+                         f'line-rate="{1 if called else 0}" branch-rate="{1 if called else 0}" complexity="0">'
+                         f'<lines><line number="{line_num_str}" hits="{called}"/></lines></method>\n')
+        parts.append('\t\t\t\t\t</methods>\n\t\t\t\t\t<lines>\n')
+        for line_no, hits, taken, total in report['lines']:
+            if total:
+                parts.append(f'\t\t\t\t\t\t<line number="{line_no}" hits="{hits}" branch="true" '
+                             f'condition-coverage="{taken * 100 // total}% ({taken}/{total})"/>\n')
+            else:
+                parts.append(f'\t\t\t\t\t\t<line number="{line_no}" hits="{hits}" branch="false"/>\n')
+        parts.append('\t\t\t\t\t</lines>\n\t\t\t\t</class>\n')
+
+        data = ''.join(parts).encode('utf-8')
+        offset = self.spool.tell()
+        self.spool.write(data)
+        self.chunks.setdefault(package, []).append(
+            (offset, len(data), report['covered'], report['total'], report['branch_taken'], report['branch_total']))
+
+    def close(self, reports):
+        totals = [0, 0, 0, 0]
+        for chunks in self.chunks.values():
+            for chunk in chunks:
+                for k in range(4):
+                    totals[k] += chunk[2 + k]
+
+        with open(self.path, 'wb') as out:
+            header = (
+                '<?xml version="1.0" ?>\n'
+                '<!DOCTYPE coverage SYSTEM "http://cobertura.sourceforge.net/xml/coverage-04.dtd">\n'
+                f'<coverage line-rate="{_rate(totals[0], totals[1])}" branch-rate="{_rate(totals[2], totals[3])}" '
+                f'lines-covered="{totals[0]}" lines-valid="{totals[1]}" '
+                f'branches-covered="{totals[2]}" branches-valid="{totals[3]}" '
+                f'complexity="0" version="gcov2html" timestamp="{int(datetime.now().timestamp())}">\n'
+                f'\t<sources>\n\t\t<source>{xml_escape(self.source_root)}</source>\n\t</sources>\n'
+                '\t<packages>\n'
+            )
+            out.write(header.encode('utf-8'))
+            for package in sorted(self.chunks):
+                chunks = self.chunks[package]
+                covered = sum(c[2] for c in chunks)
+                total = sum(c[3] for c in chunks)
+                taken = sum(c[4] for c in chunks)
+                branches = sum(c[5] for c in chunks)
+                out.write(f'\t\t<package name={quoteattr(package)} line-rate="{_rate(covered, total)}" '
+                          f'branch-rate="{_rate(taken, branches)}" complexity="0">\n\t\t\t<classes>\n'.encode('utf-8'))
+                for offset, length, *_ in chunks:
+                    self.spool.seek(offset)
+                    out.write(self.spool.read(length))
+                out.write(b'\t\t\t</classes>\n\t\t</package>\n')
+            out.write(b'\t</packages>\n</coverage>\n')
+        self.spool.close()
+
+SQLITE_BATCH_ROWS = 100000
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, generated TEXT,
+    covered INTEGER, total INTEGER, branch_taken INTEGER, branch_total INTEGER);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, run_id INTEGER REFERENCES runs(id), path TEXT, source_mtime REAL,
+    covered INTEGER, total INTEGER, branch_taken INTEGER, branch_total INTEGER, c0 REAL, c1 REAL);
+CREATE TABLE IF NOT EXISTS lines (file_id INTEGER, line_no INTEGER, hits INTEGER);
+CREATE TABLE IF NOT EXISTS branches (file_id INTEGER, line_no INTEGER, taken INTEGER, total INTEGER);
+CREATE TABLE IF NOT EXISTS functions (file_id INTEGER, name TEXT, line_no INTEGER, called INTEGER);
+CREATE INDEX IF NOT EXISTS files_run_path ON files(run_id, path);
+CREATE INDEX IF NOT EXISTS files_path ON files(path);
+"""
+
+# Index của bảng chi tiết được tạo lại sau khi nạp xong (nhanh hơn cập nhật từng dòng)
+SQLITE_DETAIL_INDEXES = {
+    'lines_file_line': "lines(file_id, line_no)",
+    'lines_uncovered': "lines(file_id) WHERE hits = 0",
+    'branches_file_line': "branches(file_id, line_no)",
+    'functions_name': "functions(name)",
+    'functions_file': "functions(file_id)",
+}
+
+class SqliteExporter:
+    # Giữ tóm tắt file của mọi lần chạy (để so sánh lịch sử); chi tiết dòng/nhánh/hàm chỉ của lần mới nhất
+    def __init__(self, path, source_root=None):
+        if sqlite3 is None:
+            raise RuntimeError("Python này không có module sqlite3")
+        self.source_root = source_root
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.executescript(SQLITE_SCHEMA)
+        self.db.execute("BEGIN")
+        for name in SQLITE_DETAIL_INDEXES:
+            self.db.execute(f"DROP INDEX IF EXISTS {name}")
+        for table in ('lines', 'branches', 'functions'):
+            self.db.execute(f"DELETE FROM {table}")
+        self.run_id = self.db.execute("INSERT INTO runs (generated) VALUES (?)",
+                                      (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),)).lastrowid
+        self.lines = []
+        self.branches = []
+        self.functions = []
+
+    def source_mtime(self, source):
+        for candidate in (source, os.path.join(self.source_root or '.', source)):
+            try:
+                return os.stat(candidate).st_mtime
+            except OSError:
+                continue
+        return None
+
+    def add(self, report):
+        file_id = self.db.execute(
+            "INSERT INTO files (run_id, path, source_mtime, covered, total, branch_taken, branch_total, c0, c1) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.run_id, report['source'], self.source_mtime(report['source']), report['covered'], report['total'],
+             report['branch_taken'], report['branch_total'],
+             report['covered'] / report['total'] * 100 if report['total'] else 0.0, report['branch_percent'])).lastrowid
+        for line_no, hits, taken, total in report['lines']:
+            self.lines.append((file_id, line_no, hits))
+            if total:
+                self.branches.append((file_id, line_no, taken, total))
+        self.functions.extend((file_id, name, int(line_num_str) if line_num_str.isdigit() else None, called)
+                              for name, line_num_str, called in report['functions'])
+        if len(self.lines) >= SQLITE_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany("INSERT INTO lines VALUES (?, ?, ?)", self.lines)
+        self.db.executemany("INSERT INTO branches VALUES (?, ?, ?, ?)", self.branches)
+        self.db.executemany("INSERT INTO functions VALUES (?, ?, ?, ?)", self.functions)
+        self.lines, self.branches, self.functions = [], [], []
+
+    def close(self, reports):
+        self.flush()
+        total_covered, total_instrumented, total_branch_taken, total_branch_total, _, _ = index_totals(reports)
+        self.db.execute("UPDATE runs SET covered = ?, total = ?, branch_taken = ?, branch_total = ? WHERE id = ?",
+                        (total_covered, total_instrumented, total_branch_taken, total_branch_total, self.run_id))
+        for name, columns in SQLITE_DETAIL_INDEXES.items():
+            self.db.execute(f"CREATE INDEX {name} ON {columns}")
+        self.db.execute("COMMIT")
+        self.db.close()
+
+LATEST_RUN = "(SELECT MAX(id) FROM runs)"
+# Cùng một path có thể xuất hiện nhiều lần trong một lần chạy (header được nhiều file .c include)
+FILE_TOTALS = """
+    WITH totals AS (
+        SELECT run_id, path, 100.0 * SUM(covered) / MAX(SUM(total), 1) AS c0,
+               100.0 * SUM(branch_taken) / MAX(SUM(branch_total), 1) AS c1
+        FROM files GROUP BY run_id, path)"""
+
+def drop_query(metric):
+    # c0-drop / c1-drop: file có coverage giảm so với lần chạy liền trước
+    return FILE_TOTALS + f"""
+        SELECT cur.path, ROUND(prev.{metric}, 1) AS before, ROUND(cur.{metric}, 1) AS after FROM totals cur
+        JOIN totals prev ON prev.path = cur.path AND prev.run_id = (SELECT MAX(id) FROM runs WHERE id < cur.run_id)
+        WHERE cur.run_id = {LATEST_RUN} AND cur.{metric} < prev.{metric}
+        ORDER BY cur.{metric} - prev.{metric}"""
+
+# Truy vấn có sẵn cho --db-query; tham số thêm được truyền theo thứ tự vào dấu ?
+DB_QUERIES = {
+    # uncovered [PREFIX] [DAYS]: dòng chưa chạy của file dưới PREFIX, source sửa trong DAYS ngày gần đây
+    'uncovered': (2, f"""
+        SELECT f.path, l.line_no FROM lines l JOIN files f ON f.id = l.file_id
+        WHERE f.run_id = {LATEST_RUN} AND l.hits = 0 AND f.path LIKE COALESCE(?, '') || '%'
+          AND (?2 IS NULL OR f.source_mtime >= strftime('%s', 'now') - ?2 * 86400)
+        ORDER BY f.path, l.line_no"""),
+    'files': (0, f"""
+        SELECT path, ROUND(c0, 1) AS c0, ROUND(c1, 1) AS c1, covered, total FROM files
+        WHERE run_id = {LATEST_RUN} ORDER BY c0"""),
+    'runs': (0, """
+        SELECT id, generated, covered, total, branch_taken, branch_total FROM runs ORDER BY id"""),
+    'c0-drop': (0, drop_query('c0')),
+    'c1-drop': (0, drop_query('c1')),
+}
+
+def run_db_query(path, query, params=()):
+    if sqlite3 is None:
+        log_event('error', 'db_error', "[ERROR] Python này không có module sqlite3")
+        return 1
+    if not os.path.exists(path):
+        log_event('error', 'db_error', f"[ERROR] Không tìm thấy database {path}", path=path)
+        return 1
+    if query in DB_QUERIES:
+        arity, sql = DB_QUERIES[query]
+        params = (list(params) + [None] * arity)[:max(arity, len(params))]
     else:
-        print("[!] Không có dữ liệu coverage hợp lệ.")
+        sql = query
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cursor = db.execute(sql, params)
+        if cursor.description:
+            print("\t".join(column[0] for column in cursor.description))
+            for row in cursor:
+                print("\t".join("" if value is None else str(value) for value in row))
+    except sqlite3.Error as e:
+        log_event('error', 'db_error', f"[ERROR] Truy vấn thất bại: {e}", error=str(e))
+        return 1
+    finally:
+        db.close()
+    return 0
+
+def open_exporters(args):
+    exporters = []
+    if args.cobertura:
+        exporters.append(CoberturaExporter(args.cobertura, args.source_root))
+    if args.lcov:
+        exporters.append(LcovExporter(args.lcov))
+    if args.json_summary:
+        exporters.append(JsonSummaryExporter(args.json_summary))
+    if args.sqlite:
+        exporters.append(SqliteExporter(args.sqlite, args.source_root))
+    if args.save_model:
+        path = args.save_model
+        if os.path.abspath(path) == os.path.abspath(MODEL_FILE):
+            path = build_path(os.path.basename(MODEL_FILE))
+        exporters.append(ModelWriter(path))
+    return exporters
+
+# ========================
+# Mô hình nhị phân: header, bảng file, bảng chuỗi và các mảng số đếm độ rộng cố định
+# (little-endian), đọc lại bằng mmap + memoryview không cần copy
+# ========================
+MODEL_MAGIC = b'GCOVMDL\0'
+MODEL_VERSION = 1
+NO_STRING = 0xFFFFFFFF
+# magic, version, file_count, string_count, line_count, function_count + offset của các section
+MODEL_HEADER = struct.Struct('<8sIQQQQ' + 'Q' * 10)
+# name, html_file, relative_path, source, input, extra (JSON) | covered, total, branch_taken,
+# branch_total | branch_percent | line_start, line_count, function_start, function_count
+MODEL_FILE_RECORD = struct.Struct('<6I4Qd4Q')
+# Thứ tự section sau bảng file: (tên, typecode của array)
+MODEL_ARRAYS = (
+    ('string_offsets', 'I'), ('string_data', 'B'),
+    ('line_no', 'I'), ('hits', 'Q'), ('taken', 'I'), ('total', 'I'),
+    ('function_name', 'I'), ('function_line', 'I'), ('function_called', 'Q'),
+)
+
+def _le_bytes(typecode, values):
+    data = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+def _le_array(view, typecode):
+    # Trên máy little-endian là memoryview trỏ thẳng vào mmap
+    if sys.byteorder == 'little':
+        return view.cast(typecode)
+    data = array.array(typecode, view)
+    data.byteswap()
+    return data
+
+class ModelWriter:
+    # Ghi theo luồng: các mảng được spool ra file tạm, chỉ bảng file và bảng chuỗi nằm trong bộ nhớ
+    def __init__(self, path):
+        self.path = path
+        self.spools = {name: tempfile.TemporaryFile() for name, _ in MODEL_ARRAYS[2:]}
+        self.strings = {}
+        self.records = []
+        self.line_count = 0
+        self.function_count = 0
+
+    def string(self, value):
+        if value is None:
+            return NO_STRING
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def add(self, report):
+        lines = report['lines']
+        functions = report['functions']
+        spools = self.spools
+        spools['line_no'].write(_le_bytes('I', (row[0] for row in lines)))
+        spools['hits'].write(_le_bytes('Q', (row[1] for row in lines)))
+        spools['taken'].write(_le_bytes('I', (row[2] for row in lines)))
+        spools['total'].write(_le_bytes('I', (row[3] for row in lines)))
+        spools['function_name'].write(_le_bytes('I', (self.string(name) for name, _, _ in functions)))
+        spools['function_line'].write(_le_bytes('I', (int(line) if line.isdigit() else 0 for _, line, _ in functions)))
+        spools['function_called'].write(_le_bytes('Q', (called for _, _, called in functions)))
+        extra = json.dumps({key: report[key] for key in ('hot_lines', 'hot_functions', 'stamp') if key in report},
+                           ensure_ascii=False, separators=(',', ':'))
+        self.records.append(MODEL_FILE_RECORD.pack(
+            self.string(report['name']), self.string(report['html_file']), self.string(report['relative_path']),
+            self.string(report['source']), self.string(report.get('input')), self.string(extra),
+            report['covered'], report['total'], report['branch_taken'], report['branch_total'],
+            report['branch_percent'], self.line_count, len(lines), self.function_count, len(functions)))
+        self.line_count += len(lines)
+        self.function_count += len(functions)
+
+    def close(self, reports):
+        encoded = [value.encode('utf-8') for value in self.strings]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as out:
+            out.write(b'\0' * MODEL_HEADER.size)
+            files_offset = out.tell()
+            out.writelines(self.records)
+            section_offsets = []
+            for name, _ in MODEL_ARRAYS:
+                out.write(b'\0' * (-out.tell() % 8))
+                section_offsets.append(out.tell())
+                if name == 'string_offsets':
+                    out.write(_le_bytes('I', offsets))
+                elif name == 'string_data':
+                    out.writelines(encoded)
+                else:
+                    spool = self.spools[name]
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, out)
+                    spool.close()
+            out.seek(0)
+            out.write(MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, len(self.records), len(encoded),
+                                        self.line_count, self.function_count, files_offset, *section_offsets))
+        os.replace(tmp_path, self.path)
+
+class ModelFile:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{path}: file mô hình rỗng")
+        self.view = memoryview(self.map)
+        try:
+            self._open_sections(path)
+        except BaseException:
+            self.close()
+            raise
+
+    def _open_sections(self, path):
+        # Kiểm tra mọi offset/kích thước trước khi dùng: file cụt hoặc hỏng phải báo ValueError,
+        # không được để lọt struct.error/IndexError hay đọc sai chỗ trong mmap
+        size = len(self.view)
+        if size < MODEL_HEADER.size:
+            raise ValueError(f"{path}: không phải file mô hình gcov2html (phiên bản {MODEL_VERSION})")
+        magic, version, self.file_count, string_count, line_count, function_count, self.files_offset, *offsets = \
+            MODEL_HEADER.unpack_from(self.view)
+        if magic != MODEL_MAGIC or version != MODEL_VERSION:
+            raise ValueError(f"{path}: không phải file mô hình gcov2html (phiên bản {MODEL_VERSION})")
+        if self.files_offset + self.file_count * MODEL_FILE_RECORD.size > size:
+            raise ValueError(f"{path}: file mô hình bị cụt (bảng file)")
+        sizes = {'string_offsets': string_count + 1, 'string_data': 0,
+                 'line_no': line_count, 'hits': line_count, 'taken': line_count, 'total': line_count,
+                 'function_name': function_count, 'function_line': function_count, 'function_called': function_count}
+        self.arrays = {}
+        for (name, typecode), offset in zip(MODEL_ARRAYS, offsets):
+            if name == 'string_data':
+                self.string_data = offset
+                continue
+            width = struct.calcsize(typecode)
+            if offset % width or offset + sizes[name] * width > size:
+                raise ValueError(f"{path}: file mô hình bị cụt hoặc hỏng (section {name})")
+            self.arrays[name] = _le_array(self.view[offset:offset + sizes[name] * width], typecode)
+
+        string_offsets = self.arrays['string_offsets']
+        if string_offsets[0] != 0 or self.string_data + string_offsets[string_count] > size:
+            raise ValueError(f"{path}: file mô hình bị cụt hoặc hỏng (section string_data)")
+        for index in range(self.file_count):
+            record = self.record(index)
+            strings_ok = all(value == NO_STRING or value < string_count for value in record[:6])
+            if (not strings_ok or record[11] + record[12] > line_count
+                    or record[13] + record[14] > function_count):
+                raise ValueError(f"{path}: bản ghi file #{index} trong mô hình không hợp lệ")
+
+    def string(self, index):
+        if index == NO_STRING:
+            return None
+        offsets = self.arrays['string_offsets']
+        return str(self.view[self.string_data + offsets[index]:self.string_data + offsets[index + 1]], 'utf-8')
+
+    def record(self, index):
+        return MODEL_FILE_RECORD.unpack_from(self.view, self.files_offset + index * MODEL_FILE_RECORD.size)
+
+    def report(self, index):
+        (name, html_file, relative_path, _, input_file, extra, covered, total, branch_taken, branch_total,
+         branch_percent, _, _, function_start, function_count) = self.record(index)
+        report = {
+            'name': self.string(name),
+            'covered': covered,
+            'total': total,
+            'branch_taken': branch_taken,
+            'branch_total': branch_total,
+            'branch_percent': branch_percent,
+            'html_file': self.string(html_file),
+            'relative_path': self.string(relative_path),
+            'function_called': sum(1 for called in self.arrays['function_called'][
+                function_start:function_start + function_count] if called > 0),
+            'function_total': function_count,
+        }
+        if input_file != NO_STRING:
+            report['input'] = self.string(input_file)
+        report.update(json.loads(self.string(extra)))
+        return report
+
+    def reports(self):
+        for index in range(self.file_count):
+            yield self.report(index)
+
+    def export_report(self, index):
+        # Bổ sung source, dòng và hàm như report ở chế độ collect (cho exporter)
+        record = self.record(index)
+        line_start, line_count, function_start, function_count = record[-4:]
+        arrays = self.arrays
+        lines = slice(line_start, line_start + line_count)
+        functions = slice(function_start, function_start + function_count)
+        report = self.report(index)
+        report['source'] = self.string(record[3])
+        report['lines'] = list(zip(arrays['line_no'][lines], arrays['hits'][lines],
+                                   arrays['taken'][lines], arrays['total'][lines]))
+        report['functions'] = [(self.string(name), str(line_no), called) for name, line_no, called in
+                               zip(arrays['function_name'][functions], arrays['function_line'][functions],
+                                   arrays['function_called'][functions])]
+        return report
+
+    def close(self):
+        # Phải giải phóng mọi memoryview trước khi đóng mmap
+        for data in getattr(self, 'arrays', {}).values():
+            if isinstance(data, memoryview):
+                data.release()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_model_reports(path, on_report=None, collect=False):
+    with ModelFile(path) as model:
+        reports = []
+        for index in range(model.file_count):
+            report = model.export_report(index) if collect else model.report(index)
+            if on_report:
+                on_report(report)
+            for key in ('lines', 'functions', 'source'):
+                report.pop(key, None)
+            reports.append(report)
+    return reports
+
+def link_previous_output(html_files):
+    # Khi chỉ dựng lại index từ mô hình, chỉ các trang có trong mô hình được hardlink sang thư mục mới;
+    # index, manifest, lịch sử và profile được ghi lại ở lần chạy này
+    target = os.path.abspath(OUTPUT_DIR)
+    if not os.path.isdir(target):
+        return
+    for entry in os.scandir(target):
+        destination = build_path(entry.name)
+        if not entry.is_file() or entry.name not in html_files or os.path.exists(destination):
+            continue
+        try:
+            os.link(entry.path, destination)
+        except OSError:
+            shutil.copy2(entry.path, destination)
+
+# ========================
+# So sánh nhiều lần chạy (--compare LABEL=MODEL): ma trận coverage theo file giữa các cấu hình
+# ========================
+def parse_compare(spec):
+    label, sep, path = spec.partition('=')
+    if not sep or not label or not path:
+        raise argparse.ArgumentTypeError(f"mô hình so sánh không hợp lệ: {spec!r} (dạng LABEL=MODEL)")
+    return label, path
+
+def model_file_key(model, record):
+    # Khớp theo Source: (giống nhau giữa các thư mục build debug/release), thiếu thì theo relative_path
+    source = model.string(record[3]) or model.string(record[2])
+    return _to_posix(os.path.normpath(source))
+
+def iter_model_files(model, column):
+    # Bảng file của mỗi mô hình được duyệt theo đường dẫn; chỉ giữ mảng chỉ số, dữ liệu dòng vẫn nằm trong mmap
+    keys = [model_file_key(model, model.record(index)) for index in range(model.file_count)]
+    for index in sorted(range(model.file_count), key=keys.__getitem__):
+        yield keys[index], column, index
+
+def align_models(models):
+    # Merge k-way theo đường dẫn: mỗi lần trả về một file với {cột: chỉ số file trong mô hình đó}
+    current, row = None, {}
+    for path, column, index in heapq.merge(*(iter_model_files(model, column) for column, model in enumerate(models))):
+        if path != current and row:
+            yield current, row
+            row = {}
+        current = path
+        row.setdefault(column, index)
+    if row:
+        yield current, row
+
+def compare_html_file(path):
+    return 'compare_' + path.replace('/', '_').replace(':', '_') + '.html'
+
+def _percent(part, whole):
+    return (part / whole * 100) if whole > 0 else 0.0
+
+def _delta_html(value, baseline):
+    if value is None or baseline is None or abs(value - baseline) < 0.05:
+        return ""
+    return f" <span class='{'delta-up' if value > baseline else 'delta-down'}'>{'▲' if value > baseline else '▼'}{abs(value - baseline):.1f}</span>"
+
+def compare_lines(models, row):
+    # {line_no: [hits hoặc None cho mỗi cột]} của một file; None = cấu hình đó không đo dòng này
+    lines = {}
+    for column, index in row.items():
+        model = models[column]
+        line_start, line_count = model.record(index)[11:13]
+        window = slice(line_start, line_start + line_count)
+        for line_no, hits in zip(model.arrays['line_no'][window], model.arrays['hits'][window]):
+            counts = lines.get(line_no)
+            if counts is None:
+                counts = lines[line_no] = [None] * len(models)
+            counts[column] = hits
+    return lines
+
+def render_compare_file_html(path, labels, lines, source_text):
+    header = "".join(f"<th>{html.escape(label)}</th>" for label in labels)
+    rows = []
+    last_line = max(len(source_text), max(lines, default=0))
+    for line_no in range(1, last_line + 1):
+        code = html.escape(source_text[line_no - 1]) if line_no <= len(source_text) else ''
+        counts = lines.get(line_no)
+        if counts is None:
+            cells = "<td class='na'></td>" * len(labels)
+            rows.append(f"<tr><td class='line-num'>{line_no}</td>{cells}<td></td><td class='code'>{code}</td></tr>")
+            continue
+        cells = "".join("<td class='na'>-</td>" if hits is None else
+                        f"<td class='{'hit' if hits else 'miss'}'>{hits:,}</td>" for hits in counts)
+        missed = [label for label, hits in zip(labels, counts) if hits == 0]
+        row_class = 'partial' if missed and len(missed) < sum(1 for hits in counts if hits is not None) else \
+            'missed' if missed else ''
+        rows.append(f"<tr class='{row_class}'><td class='line-num'>{line_no}</td>{cells}"
+                    f"<td class='missed-by'>{html.escape(', '.join(missed))}</td><td class='code'>{code}</td></tr>")
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{html.escape(path)} — Coverage Comparison</title>
+    <style>
+        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; color: #2b2d42; padding: 20px; }}
+        .container {{ max-width: 1400px; margin: 0 auto; background: white; border-radius: 16px; box-shadow: 0 10px 30px rgba(0,0,0,0.08); padding: 30px; }}
+        h1 {{ font-size: 1.5rem; margin-bottom: 15px; }}
+        a {{ color: #4361ee; text-decoration: none; }}
+        table {{ width: 100%; border-collapse: collapse; font-family: 'Fira Code', 'Consolas', monospace; font-size: 13px; }}
+        th {{ position: sticky; top: 0; background: #2b2d42; color: white; padding: 6px 8px; text-align: right; }}
+        td {{ padding: 1px 8px; white-space: pre; text-align: right; }}
+        td.code, td.missed-by, th:last-child, th:nth-last-child(2) {{ text-align: left; }}
+        .line-num {{ color: #adb5bd; }}
+        .hit {{ color: #06a77d; }}
+        .miss {{ color: #ef476f; font-weight: 700; }}
+        .na {{ color: #ced4da; }}
+        .missed-by {{ color: #ef476f; font-family: 'Segoe UI', sans-serif; }}
+        tr.missed {{ background: rgba(239, 71, 111, 0.12); }}
+        tr.partial {{ background: rgba(255, 209, 102, 0.25); }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1><a href="index.html">⬅</a> {html.escape(path)}</h1>
+        <table>
+            <tr><th>Line</th>{header}<th>Missed by</th><th>Code</th></tr>
+            {"".join(rows)}
+        </table>
+    </div>
+</body>
+</html>
+"""
+
+def render_compare_index_html(labels, rows, totals):
+    header = "".join(f"<th colspan='2'>{html.escape(label)}</th>" for label in labels)
+    subheader = "<th>C0</th><th>C1</th>" * len(labels)
+
+    def cells(values):
+        baseline = values[0]
+        out = []
+        for value in values:
+            if value is None:
+                out.append("<td class='na'>—</td><td class='na'>—</td>")
+                continue
+            c0, c1 = value
+            out.append(f"<td>{c0:.1f}%{_delta_html(c0, baseline and baseline[0])}</td>"
+                       f"<td>{c1:.1f}%{_delta_html(c1, baseline and baseline[1])}</td>")
+        return "".join(out)
+
+    body = "\n".join(
+        f"            <tr><td class='path'><a href='{html.escape(html_file)}'>{html.escape(path)}</a></td>{cells(values)}</tr>"
+        for path, html_file, values in rows)
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>📊 Coverage Comparison</title>
+    <style>
+        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; color: #2b2d42; padding: 20px; }}
+        .container {{ max-width: 1400px; margin: 0 auto; background: white; border-radius: 16px; box-shadow: 0 10px 30px rgba(0,0,0,0.08); padding: 30px; }}
+        h1 {{ font-size: 2rem; margin-bottom: 5px; }}
+        .subtitle {{ color: #adb5bd; margin-bottom: 25px; }}
+        table {{ width: 100%; border-collapse: collapse; font-size: 0.9rem; }}
+        th, td {{ padding: 6px 10px; border-bottom: 1px solid #e9ecef; text-align: right; white-space: nowrap; }}
+        th {{ background: #f8f9fa; }}
+        td.path, th.path {{ text-align: left; }}
+        td.path a {{ color: #4361ee; text-decoration: none; }}
+        tr.total td {{ font-weight: 700; background: #f8f9fa; }}
+        .delta-up {{ color: #06a77d; font-size: 0.8rem; }}
+        .delta-down {{ color: #ef476f; font-size: 0.8rem; }}
+        .na {{ color: #ced4da; }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>📊 Coverage Comparison</h1>
+        <p class="subtitle">{len(rows)} files · {len(labels)} configurations · deltas vs {html.escape(labels[0])}</p>
+        <table>
+            <tr><th class="path" rowspan="2">File</th>{header}</tr>
+            <tr>{subheader}</tr>
+            <tr class="total"><td class="path">Total</td>{cells(totals)}</tr>
+{body}
+        </table>
+    </div>
+</body>
+</html>
+"""
+
+def compare_models(specs, source_root=None):
+    labels = [label for label, _ in specs]
+    models = []
+    try:
+        for _, path in specs:
+            models.append(ModelFile(path))
+        sums = [[0, 0, 0, 0] for _ in models]
+        seen = [False] * len(models)
+        rows = []
+        matched = 0
+        for path, row in align_models(models):
+            matched += len(row) > 1
+            values = [None] * len(models)
+            source = None
+            for column, index in row.items():
+                record = models[column].record(index)
+                covered, total, branch_taken, branch_total = record[6:10]
+                values[column] = (_percent(covered, total), record[10])
+                for position, value in enumerate((covered, total, branch_taken, branch_total)):
+                    sums[column][position] += value
+                seen[column] = True
+                source = source or models[column].string(record[3])
+            html_file = compare_html_file(path)
+            source_text = _open_source_text(source or path, (), source_root)
+            write_text_atomic(build_path(html_file),
+                              render_compare_file_html(path, labels, compare_lines(models, row), source_text))
+            rows.append((path, html_file, values))
+        totals = [(_percent(s[0], s[1]), _percent(s[2], s[3])) if seen[column] else None
+                  for column, s in enumerate(sums)]
+    finally:
+        for model in models:
+            model.close()
+    if len(models) > 1 and rows and not matched:
+        log_event('warning', 'compare_unmatched', "[WARN] Không có file nào trùng đường dẫn giữa các mô hình; "
+                                                  "hãy sinh các mô hình với cùng --source-root", files=len(rows))
+    write_text_atomic(build_path(os.path.basename(INDEX_FILE)), render_compare_index_html(labels, rows, totals))
+    for label, (c0, c1) in zip(labels, (t or (0.0, 0.0) for t in totals)):
+        log_event('info', 'compare', f"[{label}] C0: {c0:.1f}% | C1: {c1:.1f}%", label=label, c0=round(c0, 2),
+                  c1=round(c1, 2))
+    log_event('info', 'index', f"📁 Mở file: {os.path.abspath(INDEX_FILE)} để xem bảng so sánh!",
+              index=os.path.abspath(INDEX_FILE), files=len(rows))
+
+# ========================
+# Manifest: danh sách file của lần chạy (dùng cho --serve)
+# ========================
+def save_manifest(reports, signature=None):
+    manifest = {
+        'generated': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'signature': signature,
+        'reports': reports,
+    }
+    write_text_atomic(build_path(os.path.basename(MANIFEST_FILE)), json.dumps(manifest, ensure_ascii=False))
+
+def load_manifest(path=MANIFEST_FILE, signature=None):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if signature is not None and manifest.get('signature') != signature:
+        return []
+    return manifest.get('reports', [])
+
+def entry_from_report(report):
+    return {
+        'input': report['input'],
+        'name': report['name'],
+        'html_file': report['html_file'],
+        'relative_path': report['relative_path'],
+        'relative_dir': os.path.dirname(report['relative_path']),
+    }
+
+# ========================
+# Chế độ --serve: render trang khi được yêu cầu, có LRU cache
+# ========================
+class PageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.pages = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, stamp):
+        with self.lock:
+            entry = self.pages.get(key)
+            if entry is None or entry[0] != stamp:
+                return None
+            self.pages.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, stamp, data):
+        with self.lock:
+            old = self.pages.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.pages[key] = (stamp, data)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.pages) > 1:
+                _, (_, evicted) = self.pages.popitem(last=False)
+                self.size -= len(evicted)
+
+def input_stamp(entry):
+    # Bản ghi từ tracefile không có file riêng để theo dõi
+    if not isinstance(entry['input'], str):
+        return None
+    return file_stamp(entry['input'])
+
+class LiveReport:
+    def __init__(self, source_filter, cache_bytes, highlight=False):
+        self.source_filter = source_filter
+        self.highlight = highlight
+        self.cache = PageCache(cache_bytes)
+        self.entries = {}
+        self.summaries = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        history = load_history()
+        self.previous = history[-1] if history else None
+
+    def add_entry(self, entry, report=None):
+        with self.lock:
+            self.entries[entry['html_file']] = entry
+            if report is not None:
+                self.summaries[entry['html_file']] = report
+                self.version += 1
+
+    def index(self):
+        with self.lock:
+            version = self.version
+            reports = list(self.summaries.values())
+        cached = self.cache.get('index.html', version)
+        if cached is None:
+            cached = render_index_html(reports, self.previous).encode('utf-8')
+            self.cache.put('index.html', version, cached)
+        return cached
+
+    def page(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        stamp = input_stamp(entry)
+        cached = self.cache.get(name, stamp)
+        if cached is not None:
+            return cached
+
+        model = load_model(entry, self.source_filter)
+        if model is None:
+            return None
+        data = render_gcov_html(model, entry['relative_dir'], self.highlight).encode('utf-8')
+        self.cache.put(name, stamp, data)
+        if model['total'] > 0:
+            report = finish_report(model, entry, {'render': False})
+            with self.lock:
+                self.summaries[name] = report
+                self.version += 1
+        return data
+
+    def scan(self, inputs, jobs, options):
+        # Chạy nền: cập nhật danh sách file và số liệu cho index
+        def register(items):
+            for item in items:
+                entry = describe_input(item, self.source_filter)
+                if entry is not None:
+                    self.add_entry(entry)
+                yield item
+
+        def on_report(report):
+            with self.lock:
+                self.summaries[report['html_file']] = report
+                self.version += 1
+
+        found, reports = run_reports(register(inputs), jobs, dict(options, render=False, collect=False), on_report)
+        log_event('info', 'scan_done', f"[OK] Đã phân tích {len(reports)}/{found} file", files=len(reports), found=found)
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        name = self.path.split('?', 1)[0].lstrip('/') or 'index.html'
+        report = self.server.report
+        try:
+            data = report.index() if name == 'index.html' else report.page(name)
+        except Exception as e:
+            log_event('error', 'serve_error', f"[ERROR] Render {name} thất bại: {e}", path=name, error=str(e))
+            self.send_error(500)
+            return
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log_event('debug', 'http', "[HTTP] " + format % args)
+
+def serve_report(inputs, options, host, port, cache_mb, jobs):
+    report = LiveReport(options.get('source_filter'), int(cache_mb * 1048576), options.get('highlight', False))
+    for saved in load_manifest():
+        if saved.get('input'):
+            report.add_entry(entry_from_report(saved), saved)
+
+    server = ThreadingHTTPServer((host, port), ReportRequestHandler)
+    server.daemon_threads = True
+    server.report = report
+    scanner = threading.Thread(target=report.scan, args=(inputs, jobs, options), daemon=True)
+    scanner.start()
+
+    log_event('info', 'serve', f"🌐 Đang phục vụ báo cáo tại http://{host}:{server.server_address[1]}/ (Ctrl+C để dừng)",
+              url=f"http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# ========================
+# Chế độ --watch: chỉ render lại file có dữ liệu thay đổi
+# ========================
+def snapshot_inputs(paths):
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+def _watch_dirs(roots, skip, prune):
+    for root in roots:
+        for current, dirs, _ in os.walk(os.path.normpath(root)):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in prune
+                       and not _match_any(_to_posix(os.path.join(current, d)), skip)]
+            yield current
+
+class PollWatcher:
+    def __init__(self, discover, interval):
+        self.discover = discover
+        self.interval = interval
+        self.snapshot = snapshot_inputs(discover())
+
+    def wait(self):
+        # Trả về (changed, removed) sau khi các thay đổi đã ngừng trong WATCH_DEBOUNCE giây
+        while True:
+            time.sleep(self.interval)
+            current = snapshot_inputs(self.discover())
+            if current == self.snapshot:
+                continue
+            while True:
+                time.sleep(WATCH_DEBOUNCE)
+                newer = snapshot_inputs(self.discover())
+                if newer == current:
+                    break
+                current = newer
+            changed = [p for p, stamp in current.items() if self.snapshot.get(p) != stamp]
+            removed = [p for p in self.snapshot if p not in current]
+            self.snapshot = current
+            return changed, removed
+
+class InotifyWatcher:
+    def __init__(self, roots, match, skip, prune):
+        self.match = match
+        self.skip = skip
+        self.prune = prune
+        self.inotify = inotify_simple.INotify()
+        self.mask = (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO |
+                     inotify_simple.flags.MOVED_FROM | inotify_simple.flags.DELETE |
+                     inotify_simple.flags.CREATE)
+        self.dirs = {}
+        for directory in _watch_dirs(roots, skip, prune):
+            self._add(directory)
+
+    def _add(self, directory):
+        try:
+            self.dirs[self.inotify.add_watch(directory, self.mask)] = directory
+        except OSError:
+            pass
+
+    def _collect(self, events, paths):
+        for event in events:
+            directory = self.dirs.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.normpath(os.path.join(directory, event.name))
+            if event.mask & inotify_simple.flags.ISDIR:
+                if event.mask & inotify_simple.flags.CREATE and event.name not in self.prune:
+                    for sub in _watch_dirs([path], self.skip, self.prune):
+                        self._add(sub)
+                continue
+            rel = _to_posix(path)
+            if _match_any(rel, self.match) and not _match_any(rel, self.skip):
+                paths.add(path)
+
+    def wait(self):
+        paths = set()
+        while not paths:
+            self._collect(self.inotify.read(), paths)
+        # Gom các sự kiện liên tiếp (vd. gcov ghi nhiều file) trước khi xử lý
+        while True:
+            events = self.inotify.read(timeout=int(WATCH_DEBOUNCE * 1000))
+            if not events:
+                break
+            self._collect(events, paths)
+        changed = [p for p in paths if os.path.exists(p)]
+        removed = [p for p in paths if not os.path.exists(p)]
+        return changed, removed
+
+def make_watcher(roots, match, skip, prune, discover, interval):
+    if inotify_simple is not None and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(roots, match, skip, prune)
+        except OSError as e:
+            log_event('warning', 'watch_fallback', f"[WARN] Không dùng được inotify ({e}), chuyển sang polling")
+    return PollWatcher(discover, interval)
+
+def write_live_index(reports, previous, signature=None):
+    write_text_atomic(INDEX_FILE, render_index_html(reports, previous))
+    save_manifest(reports, signature)
+
+def watch_reports(reports, watcher, gcda_command, jobs, options, signature=None):
+    static_reports = [r for r in reports if 'input' not in r and 'inputs' not in r]
+    by_input = {r['input']: r for r in reports if 'input' in r}
+    by_header = {}
+    headers = {}
+    for r in reports:
+        if 'inputs' in r:
+            key = header_key(r['inputs'][0])
+            by_header[key] = r
+            headers[key] = set(r['inputs'])
+    history = load_history()
+    previous = history[-2] if len(history) > 1 else None
+    log_event('info', 'watch', f"👀 Đang theo dõi thay đổi ({type(watcher).__name__}), Ctrl+C để dừng")
+
+    while True:
+        changed, removed = watcher.wait()
+        gcda_changed = [p for p in changed if p.endswith('.gcda')]
+        if gcda_changed and gcda_command:
+            # File .gcov mới do lệnh này sinh ra sẽ được bắt ở vòng theo dõi sau
+            log_event('info', 'gcda', f"[WATCH] {len(gcda_changed)} file .gcda thay đổi → chạy: {gcda_command}",
+                      files=len(gcda_changed))
+            subprocess.run(gcda_command, shell=True)
+        changed = [p for p in changed if not p.endswith('.gcda')]
+        removed = [p for p in removed if not p.endswith('.gcda')]
+        if not changed and not removed:
+            continue
+
+        start = time.perf_counter()
+        groups = regroup_headers(headers, [p for p in changed if is_mangled(p)], [p for p in removed if is_mangled(p)])
+        changed = [p for p in changed if not is_mangled(p)]
+        stale = [by_input.pop(path, None) for path in removed]
+        for group in groups:
+            if not group['gcov_files']:
+                del headers[group['source']]
+                stale.append(by_header.pop(group['source'], None))
+        for report in stale:
+            if report:
+                try:
+                    os.remove(os.path.join(OUTPUT_DIR, report['html_file']))
+                except OSError:
+                    pass
+
+        groups = [group for group in groups if group['gcov_files']]
+        items = changed + groups
+        _, updated = run_reports(items, min(jobs, max(1, len(items))), options)
+        updated_inputs = set()
+        for report in updated:
+            # Lỗi ghi đã được log; trang sẽ được ghi lại ở lần thay đổi kế tiếp
+            report.pop('write_error', None)
+            if 'inputs' in report:
+                by_header[header_key(report['inputs'][0])] = report
+                continue
+            by_input[report['input']] = report
+            updated_inputs.add(report['input'])
+        for path in changed:
+            if path not in updated_inputs:
+                by_input.pop(path, None)
+
+        all_reports = static_reports + list(by_input.values()) + list(by_header.values())
+        write_live_index(all_reports, previous, signature)
+        _, _, _, _, overall_c0, overall_c1 = index_totals(all_reports)
+        log_event('info', 'watch_update',
+                  f"[WATCH] Cập nhật {len(items)} file, xoá {len(removed)} file trong "
+                  f"{time.perf_counter() - start:.2f}s | C0: {overall_c0:.1f}% | C1: {overall_c1:.1f}%",
+                  changed=len(items), removed=len(removed), c0=round(overall_c0, 2), c1=round(overall_c1, 2))
+
+# ========================
+# Đo thời gian từng giai đoạn (--profile)
+# ========================
+def new_profile():
+    return {'start': time.perf_counter(), 'discovery': 0.0, 'export': 0.0, 'index': 0.0, 'workers': {}}
+
+def timed_inputs(inputs, profile):
+    # Chỉ tính thời gian nằm trong bộ sinh đầu vào (quét thư mục, đọc tracefile)
+    iterator = iter(inputs)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            profile['discovery'] += time.perf_counter() - start
+            return
+        profile['discovery'] += time.perf_counter() - start
+        yield item
+
+def add_stage_stats(profile, stats):
+    worker = profile['workers'].setdefault(stats['worker'], {
+        'files': 0, 'parse': 0.0, 'render': 0.0, 'write': 0.0, 'write_wait': 0.0, 'lines': 0, 'bytes': 0})
+    worker['files'] += 1
+    for key in ('parse', 'render', 'write', 'write_wait', 'lines', 'bytes'):
+        worker[key] += stats[key]
+
+def add_write_stats(profile, written):
+    # Thời gian ghi và số byte đến từ thread ghi nền, tổng kết một lần cho mỗi tiến trình khi drain
+    worker = profile['workers'].setdefault(written['worker'], {
+        'files': 0, 'parse': 0.0, 'render': 0.0, 'write': 0.0, 'write_wait': 0.0, 'lines': 0, 'bytes': 0})
+    worker['write'] += written['write']
+    worker['bytes'] += written['bytes']
+
+def format_profile(profile):
+    wall = time.perf_counter() - profile['start']
+    workers = profile['workers'].values()
+    files = sum(w['files'] for w in workers)
+    lines = sum(w['lines'] for w in workers)
+    written = sum(w['bytes'] for w in workers)
+
+    rows = [
+        "Giai đoạn      Thời gian (s)",
+        f"discovery      {profile['discovery']:>13.3f}",
+        f"parse          {sum(w['parse'] for w in workers):>13.3f}",
+        f"render         {sum(w['render'] for w in workers):>13.3f}",
+        f"write          {sum(w['write'] for w in workers):>13.3f}",
+        f"write_wait     {sum(w['write_wait'] for w in workers):>13.3f}",
+        f"export         {profile['export']:>13.3f}",
+        f"index          {profile['index']:>13.3f}",
+        f"wall           {wall:>13.3f}",
+        "",
+        f"Files: {files:,} ({files / wall if wall else 0:,.1f} file/s) | "
+        f"Lines: {lines:,} ({lines / wall if wall else 0:,.0f} dòng/s) | "
+        f"Written: {written / 1048576:,.2f} MB",
+        "",
+        "Worker     files     parse(s)    render(s)     write(s)      wait(s)        lines     bytes",
+    ]
+    for pid, w in sorted(profile['workers'].items()):
+        rows.append(f"{pid:<8} {w['files']:>7} {w['parse']:>12.3f} {w['render']:>12.3f} "
+                    f"{w['write']:>12.3f} {w['write_wait']:>12.3f} {w['lines']:>12,} {w['bytes']:>9,}")
+    return "\n".join(rows)
+
+def start_capture(mode):
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if mode == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start(10)
+    return None
+
+def finish_capture(mode, profiler, output_dir):
+    if mode == 'cprofile':
+        import io
+        import pstats
+        profiler.disable()
+        raw_file = os.path.join(output_dir, 'profile.prof')
+        profiler.dump_stats(raw_file)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+        return raw_file, stream.getvalue()
+    if mode == 'tracemalloc':
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        raw_file = os.path.join(output_dir, 'tracemalloc.snapshot')
+        snapshot.dump(raw_file)
+        rows = [f"Bộ nhớ hiện tại: {current / 1048576:.2f} MB | đỉnh: {peak / 1048576:.2f} MB", ""]
+        rows.extend(str(stat) for stat in snapshot.statistics('lineno')[:30])
+        return raw_file, "\n".join(rows)
+    return None, ""
+
+def write_profile(profile, capture_mode=None, profiler=None):
+    # Ghi vào thư mục build (staging nếu có) để publish_output mang profile sang báo cáo mới
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    raw_file, capture_text = finish_capture(capture_mode, profiler, BUILD_DIR)
+    summary = format_profile(profile)
+    summary_file = build_path('profile.txt')
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        f.write(summary + "\n")
+        if capture_text:
+            f.write("\n" + capture_text + "\n")
+
+    # Qua log_event để --log-format json vẫn chỉ gồm các dòng JSON
+    summary_path = os.path.abspath(os.path.join(OUTPUT_DIR, 'profile.txt'))
+    raw_path = os.path.abspath(os.path.join(OUTPUT_DIR, os.path.basename(raw_file))) if raw_file else None
+    message = f"\n{summary}\n📁 Profile: {summary_path}"
+    if raw_path:
+        message += f"\n📁 Dữ liệu thô: {raw_path}"
+    log_event('info', 'profile', message, path=summary_path, raw=raw_path, summary=summary.split("\n"))
+
+# ========================
+# Main
+# ========================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chuyển các file .gcov thành báo cáo HTML.")
+    parser.add_argument('roots', nargs='*',
+                        help="thư mục gốc để tìm file .gcov (mặc định: thư mục hiện tại)")
+    parser.add_argument('--match', action='append', metavar='GLOB',
+                        help="mẫu glob cho file đầu vào, có thể lặp lại (mặc định: *.gcov)")
+    parser.add_argument('--skip', action='append', default=[], metavar='GLOB',
+                        help="mẫu glob cho file/thư mục cần bỏ qua, có thể lặp lại")
+    parser.add_argument('--prune', action='append', default=[], metavar='NAME',
+                        help="tên thư mục không quét vào, thêm vào danh sách mặc định")
+    parser.add_argument('--no-default-prune', action='store_true',
+                        help="không dùng danh sách thư mục bỏ qua mặc định")
+    parser.add_argument('--files-from', metavar='FILE',
+                        help="đọc danh sách file .gcov từ FILE thay vì quét ('-' = stdin)")
+    parser.add_argument('--from-lcov', action='append', default=[], metavar='FILE',
+                        help="đọc coverage từ tracefile LCOV (.info) thay vì .gcov, có thể lặp lại")
+    parser.add_argument('--from-cobertura', action='append', default=[], metavar='FILE',
+                        help="đọc coverage từ Cobertura XML (vd. coverlet), có thể lặp lại")
+    parser.add_argument('--memory-limit', type=parse_size, metavar='SIZE',
+                        help="ngân sách bộ nhớ khi gộp nhiều tracefile (vd. 2G); vượt quá thì tràn ra file tạm "
+                             "đã sắp xếp rồi merge ngoài")
+    parser.add_argument('--source-root', metavar='DIR',
+                        help="thư mục gốc của mã nguồn; đường dẫn trong báo cáo tính theo thư mục này "
+                             "và file nằm ngoài sẽ bị bỏ qua")
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help="chỉ giữ file có đường dẫn Source: khớp mẫu, có thể lặp lại")
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help="bỏ file có đường dẫn Source: khớp mẫu, có thể lặp lại")
+    parser.add_argument('--keep-external', action='store_true',
+                        help="giữ header hệ thống/bên ngoài (/usr/include, ngoài --source-root)")
+    parser.add_argument('--highlight', action='store_true',
+                        help="tô màu cú pháp C/C++ cho mã nguồn (token được cache trong "
+                             f"{HIGHLIGHT_CACHE_DIR}, tối đa {HIGHLIGHT_CACHE_MAX_BYTES // (1024 * 1024)}MB)")
+    parser.add_argument('--context', action='append', type=parse_context, default=[], metavar='LABEL=DIR',
+                        help="thư mục .gcov của một test/shard, có thể lặp lại; ghi nhận test nào chạy từng dòng")
+    parser.add_argument('--who-covers', metavar='FILE[:LINE]|LABEL',
+                        help=f"tra {CONTEXTS_FILE} của lần chạy trước: test nào chạy FILE:LINE, "
+                             "hoặc các dòng mà test LABEL chạy")
+    parser.add_argument('--check', action='store_true',
+                        help="chỉ kiểm tra ngưỡng coverage, không sinh HTML; exit 1 nếu không đạt")
+    parser.add_argument('--min-c0', type=float, metavar='PCT', help="ngưỡng C0 tối thiểu (cho --check)")
+    parser.add_argument('--min-c1', type=float, metavar='PCT', help="ngưỡng C1 tối thiểu (cho --check)")
+    parser.add_argument('--threshold', action='append', default=[], type=parse_threshold, metavar='DIR=C0[:C1]',
+                        help="ngưỡng riêng cho thư mục (theo đường dẫn trong báo cáo), có thể lặp lại")
+    parser.add_argument('--check-format', choices=('text', 'json'), default='text',
+                        help="định dạng kết quả --check (mặc định: text)")
+    parser.add_argument('--diff', metavar='PATCH',
+                        help="chỉ xử lý file bị unified diff PATCH chạm tới, tính coverage của các dòng thay đổi "
+                             f"và ghi {PATCH_FILE} (không sinh lại báo cáo); exit 1 nếu dưới --min-patch")
+    parser.add_argument('--min-patch', type=float, default=100.0, metavar='PCT',
+                        help="ngưỡng patch coverage tối thiểu cho --diff (mặc định: 100)")
+    parser.add_argument('--cobertura', metavar='FILE', help="xuất thêm báo cáo Cobertura XML")
+    parser.add_argument('--lcov', metavar='FILE', help="xuất thêm tracefile LCOV (.info)")
+    parser.add_argument('--json-summary', metavar='FILE', help="xuất thêm bản tóm tắt JSON")
+    parser.add_argument('--save-model', nargs='?', const=MODEL_FILE, metavar='FILE',
+                        help=f"ghi mô hình nhị phân (mặc định {MODEL_FILE}) để --from-model đọc lại bằng mmap")
+    parser.add_argument('--from-model', metavar='FILE',
+                        help="dựng lại index / chạy --check / xuất từ mô hình nhị phân thay vì parse .gcov")
+    parser.add_argument('--compare', action='append', type=parse_compare, default=[], metavar='LABEL=MODEL',
+                        help="so sánh nhiều mô hình --save-model (vd. debug/release), có thể lặp lại; "
+                             "sinh ma trận coverage theo file thay cho báo cáo thường")
+    parser.add_argument('--sqlite', metavar='DB', help="nạp số liệu file/dòng/nhánh/hàm vào database SQLite")
+    parser.add_argument('--db-query', nargs='+', metavar=('QUERY', 'ARG'),
+                        help="truy vấn database --sqlite (mặc định coverage.db): "
+                             f"{', '.join(sorted(DB_QUERIES))} hoặc câu SQL; ARG thay cho dấu ?")
+    parser.add_argument('--fsync', action='store_true',
+                        help=f"fsync toàn bộ thư mục báo cáo ({FSYNC_THREADS} luồng song song) trước khi đổi sang báo cáo mới")
+    parser.add_argument('--profile', action='store_true',
+                        help="in thời gian từng giai đoạn và ghi profile.txt cạnh index.html")
+    parser.add_argument('--profile-capture', choices=('cprofile', 'tracemalloc'),
+                        help="ghi thêm dữ liệu cProfile/tracemalloc (chạy tuần tự, -j 1)")
+    parser.add_argument('--log-level', choices=tuple(LOG_LEVELS), default='info',
+                        help="mức log tối thiểu (mặc định: info)")
+    parser.add_argument('-v', '--verbose', action='store_const', const='debug', dest='log_level',
+                        help="tương đương --log-level debug (hiện từng file khi chạy song song)")
+    parser.add_argument('-q', '--quiet', action='store_const', const='warning', dest='log_level',
+                        help="chỉ in cảnh báo và lỗi")
+    parser.add_argument('--log-format', choices=('text', 'json'), default='text',
+                        help="text hoặc JSON lines cho pipeline log (mặc định: text)")
+    parser.add_argument('--progress', action='store_true',
+                        help="hiện bộ đếm tiến độ (cập nhật mỗi %.1fs) thay cho từng dòng mỗi file" % PROGRESS_INTERVAL)
+    parser.add_argument('--watch', action='store_true',
+                        help="sau khi sinh báo cáo, theo dõi và chỉ render lại các file .gcov thay đổi")
+    parser.add_argument('--watch-interval', type=float, default=1.0, metavar='SEC',
+                        help="chu kỳ polling khi không có inotify (mặc định: 1.0s)")
+    parser.add_argument('--on-gcda', metavar='CMD',
+                        help="lệnh shell chạy khi file .gcda thay đổi trong --watch (vd. lệnh gcov)")
+    parser.add_argument('--serve', action='store_true',
+                        help="chạy web server cục bộ, render từng trang khi được mở")
+    parser.add_argument('--bind', default='127.0.0.1', help="địa chỉ cho --serve (mặc định: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="cổng cho --serve (mặc định: 8000)")
+    parser.add_argument('--cache-mb', type=float, default=64,
+                        help="dung lượng tối đa của cache trang cho --serve (MB, mặc định: 64)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="số tiến trình xử lý song song (mặc định: số CPU)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = new_profile()
+    if args.profile_capture:
+        args.profile = True
+        args.jobs = 1
+    profiler = start_capture(args.profile_capture)
+    # Khi chạy song song hoặc có bộ đếm tiến độ, dòng [OK] từng file chỉ hiện ở mức debug
+    log_config = {
+        'level': args.log_level,
+        'format': args.log_format,
+        'file_level': 'info' if args.jobs <= 1 and not args.progress else 'debug',
+    }
+    configure_logging(log_config)
+    if args.diff and (args.from_model or args.serve or args.watch or args.cobertura or args.lcov
+                      or args.json_summary or args.sqlite or args.save_model):
+        # Kết quả --diff chỉ gồm các file bị patch chạm tới, không được ghi đè báo cáo/xuất dữ liệu đầy đủ
+        log_event('error', 'usage', "[ERROR] --diff không dùng chung với --from-model, --serve, --watch "
+                                    "hoặc các tuỳ chọn xuất dữ liệu", option='diff')
+        sys.exit(1)
+    prune = set(args.prune)
+    if not args.no_default_prune:
+        prune |= DEFAULT_PRUNE_DIRS
+    if args.highlight:
+        prune_highlight_cache()
+
+    if args.who_covers:
+        sys.exit(query_contexts(args.who_covers))
+    if args.db_query:
+        sys.exit(run_db_query(args.sqlite or 'coverage.db', args.db_query[0], args.db_query[1:]))
+
+    if args.compare:
+        staging = prepare_output_dir()
+        try:
+            compare_models(args.compare, args.source_root)
+        except (OSError, ValueError, struct.error) as e:
+            discard_output(staging)
+            log_event('error', 'model_error', f"[ERROR] Không đọc được mô hình so sánh: {e}", error=str(e))
+            sys.exit(1)
+        except BaseException:
+            discard_output(staging)
+            raise
+        publish_output(staging)
+        return
+
+    staging = None
+    # Mọi lỗi (kể cả sys.exit) trước khi publish đều phải dọn thư mục staging
+    try:
+        if not args.check and not args.serve and not args.diff:
+            staging = prepare_output_dir()
+
+        tracefiles = args.from_lcov or args.from_cobertura
+        inputs = iter_tracefile_records(args.from_lcov, args.from_cobertura, args.memory_limit)
+        scan_gcov = bool(args.roots or args.files_from or not tracefiles) and not args.context and not args.from_model
+        if args.context:
+            inputs = itertools.chain(discover_context_groups(args.context, args.match or ['*.gcov'], args.skip, prune),
+                                     inputs)
+        if scan_gcov:
+            gcov_files = discover_gcov_files(
+                roots=args.roots or ['.'],
+                match=args.match or ['*.gcov'],
+                skip=args.skip,
+                prune=prune,
+                files_from=args.files_from,
+            )
+            if args.watch and args.files_from:
+                gcov_files = list(gcov_files)
+            inputs = itertools.chain(consolidate_headers(gcov_files), inputs)
+        patch = None
+        if args.diff:
+            try:
+                patch = read_unified_diff(args.diff)
+            except OSError as e:
+                log_event('error', 'diff_error', f"[ERROR] Không đọc được patch {args.diff}: {e}",
+                          path=args.diff, error=str(e))
+                sys.exit(1)
+            inputs = patch_inputs(inputs, patch)
+        source_filter = {
+            'root': args.source_root,
+            'include': args.include,
+            'exclude': args.exclude,
+            'keep_external': args.keep_external,
+        }
+        if args.serve:
+            serve_report(inputs, {'source_filter': source_filter, 'highlight': args.highlight, 'log': log_config},
+                         args.bind, args.port, args.cache_mb, args.jobs)
+            return
+
+        exporters = open_exporters(args)
+        options = {
+            'source_filter': source_filter,
+            'render': not args.check and not args.diff,
+            'collect': bool(exporters),
+            'highlight': args.highlight,
+            'log': log_config,
+            'build_dir': BUILD_DIR,
+            'patch': patch,
+        }
+        signature = None
+        reused = []
+        if staging:
+            signature = render_signature(options)
+            # Exporter cần mô hình đầy đủ nên không thể bỏ qua bước parse
+            if not exporters and not args.from_model:
+                previous = {report['input']: report
+                            for report in load_manifest(signature=signature) if 'input' in report}
+                inputs = reuse_unchanged(inputs, previous, reused)
+
+        context_files = {}
+        patch_files = {}
+        write_errors = []
+
+        # Tạo watcher trước lần sinh đầu tiên để không bỏ sót file thay đổi trong lúc đang sinh
+        watcher = None
+        if args.watch and scan_gcov:
+            roots = args.roots or ['.']
+            match = (args.match or ['*.gcov']) + (['*.gcda'] if args.on_gcda else [])
+            if args.files_from:
+                listed = gcov_files
+                watcher = PollWatcher(lambda: listed, args.watch_interval)
+            else:
+                watcher = make_watcher(roots, match, args.skip, prune,
+                                       lambda: discover_gcov_files(roots, match, args.skip, prune),
+                                       args.watch_interval)
+
+        def on_report(report):
+            if report.pop('write_error', False):
+                write_errors.append(report['html_file'])
+            if 'stats' in report:
+                add_stage_stats(profile, report['stats'])
+            if 'contexts' in report:
+                context_files[_to_posix(report['relative_path'])] = report.pop('contexts')
+            if 'patch' in report:
+                patch_files[report['html_file']] = report.pop('patch')
+            start = time.perf_counter()
+            for exporter in exporters:
+                exporter.add(report)
+            profile['export'] += time.perf_counter() - start
+
+        def on_written(written):
+            add_write_stats(profile, written)
+            write_errors.extend(os.path.basename(path) for path in written['failures'])
+
+        try:
+            if args.from_model:
+                start = time.perf_counter()
+                reports = load_model_reports(args.from_model, on_report, collect=bool(exporters))
+                found = len(reports)
+                profile['discovery'] += time.perf_counter() - start
+            else:
+                found, reports = run_reports(timed_inputs(inputs, profile), args.jobs, options, on_report,
+                                             make_progress(args.progress), on_written)
+        except (OSError, ValueError) as e:
+            if not args.from_model:
+                raise
+            log_event('error', 'model_error', f"[ERROR] Không đọc được mô hình {args.from_model}: {e}",
+                      path=args.from_model, error=str(e))
+            sys.exit(1)
+        if args.from_model and staging:
+            link_previous_output({report['html_file'] for report in reports})
+        if write_errors:
+            # Không publish báo cáo thiếu trang
+            log_event('error', 'write_error', f"[ERROR] Ghi thất bại {len(write_errors)} trang HTML, giữ nguyên báo cáo cũ",
+                      files=write_errors)
+            sys.exit(1)
+        if reused:
+            found = True
+            reports = reused + reports
+            log_event('info', 'reuse', f"[..] Dùng lại {len(reused)} trang không đổi từ lần sinh trước",
+                      reused=len(reused))
+        start = time.perf_counter()
+        for exporter in exporters:
+            exporter.close(reports)
+        profile['export'] += time.perf_counter() - start
+        if patch is not None and not args.check:
+            # Chỉ ghi patch.html cạnh báo cáo đã publish: index, manifest và lịch sử chỉ được sinh từ toàn bộ dự án
+            patch_summary = summarize_patch(reports, patch_files, args.min_patch)
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            write_text_atomic(PATCH_FILE, render_patch_html(patch_summary))
+            print_patch_summary(patch_summary, args.check_format)
+            log_event('info', 'patch', f"📁 Patch coverage: {os.path.abspath(PATCH_FILE)}",
+                      path=os.path.abspath(PATCH_FILE))
+            if args.profile:
+                write_profile(profile, args.profile_capture, profiler)
+            sys.exit(0 if patch_summary['passed'] else 1)
+        if patch is not None and not reports:
+            # Patch không chạm tới file nào có đo coverage: không có gì để kiểm tra
+            print_patch_summary(summarize_patch([], patch_files, args.min_patch), args.check_format)
+            sys.exit(0)
+        if not found:
+            log_event('error', 'no_input', "[!] Không tìm thấy file .gcov hoặc dữ liệu coverage nào.\n"
+                                           "→ Hãy chạy `gcov -b your_file.c` để sinh file .gcov")
+            sys.exit(1)
+
+        if args.check:
+            thresholds = list(args.threshold)
+            if args.min_c0 is not None or args.min_c1 is not None:
+                thresholds.append(('', args.min_c0, args.min_c1))
+            summary = check_reports(reports, thresholds)
+            print_check_summary(summary, args.check_format)
+            passed = summary['passed']
+            if patch is not None:
+                patch_summary = summarize_patch(reports, patch_files, args.min_patch)
+                print_patch_summary(patch_summary, args.check_format)
+                passed = passed and patch_summary['passed']
+            if args.profile:
+                write_profile(profile, args.profile_capture, profiler)
+            sys.exit(0 if passed else 1)
+
+        if reports:
+            start = time.perf_counter()
+            generate_index_html(reports)
+            save_manifest(reports, signature)
+            if args.context:
+                save_contexts([label for label, _ in args.context], context_files)
+            profile['index'] = time.perf_counter() - start
+            # try:
+            #     webbrowser.open('file://' + os.path.abspath(INDEX_FILE))
+            # except:
+            #     print(f"🌐 Mở thủ công: {os.path.abspath(INDEX_FILE)}")
+        else:
+            log_event('warning', 'no_data', "[!] Không có dữ liệu coverage hợp lệ.")
+
+        if args.profile:
+            write_profile(profile, args.profile_capture, profiler)
+        publish_output(staging, args.fsync)
+    except BaseException:
+        if staging:
+            discard_output(staging)
+        raise
+
+    if watcher is not None:
+        try:
+            watch_reports(reports, watcher, args.on_gcda, args.jobs,
+                          dict(options, collect=False, build_dir=OUTPUT_DIR), signature)
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,518 @@
+import os
+import json
+import argparse
+import textwrap
+
+import pytest
+
+import gcov2html
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(textwrap.dedent(text).lstrip('\n'), encoding='utf-8')
+    return str(path)
+
+
+# ========================
+# read_unified_diff
+# ========================
+def test_diff_hunk_ranges(tmp_path):
+    path = write(tmp_path, 'change.diff', '''
+        diff --git a/src/main.c b/src/main.c
+        index 1111111..2222222 100644
+        --- a/src/main.c
+        +++ b/src/main.c
+        @@ -3,4 +3,6 @@ int main(void)
+         int a;
+        +int b;
+        +int c;
+         int d;
+        -int e;
+        +int f;
+         int g;
+        @@ -20 +22,2 @@
+        +int h;
+         int i;
+        ''')
+    assert gcov2html.read_unified_diff(path) == {'src/main.c': [[4, 5], [7, 7], [22, 22]]}
+
+
+def test_diff_content_lines_that_look_like_headers(tmp_path):
+    # Dòng thêm "++ x" hiện ra là "+++ x", dòng xoá "-- y" là "--- y": vẫn là nội dung của hunk;
+    # "+new" nằm sau khi hunk đã đủ số dòng nên không được tính
+    path = write(tmp_path, 'tricky.diff', '''
+        --- a/notes.txt
+        +++ b/notes.txt
+        @@ -1,2 +1,3 @@
+        --- y
+        +++ x
+        +++ b/other.c
+         keep
+        +new
+        ''')
+    assert gcov2html.read_unified_diff(path) == {'notes.txt': [[1, 2]]}
+
+
+def test_diff_deleted_and_renamed_files(tmp_path):
+    path = write(tmp_path, 'files.diff', '''
+        diff --git a/old.c b/old.c
+        deleted file mode 100644
+        --- a/old.c
+        +++ /dev/null
+        @@ -1,2 +0,0 @@
+        -int gone;
+        -int also_gone;
+        diff --git a/util.h b/include/util.h
+        similarity index 100%
+        rename from util.h
+        rename to include/util.h
+        diff --git a/a.c b/lib/a.c
+        similarity index 80%
+        rename from a.c
+        rename to lib/a.c
+        --- a/a.c
+        +++ b/lib/a.c
+        @@ -1 +1 @@
+        -int x;
+        +int y;
+        \\ No newline at end of file
+        ''')
+    assert gcov2html.read_unified_diff(path) == {'lib/a.c': [[1, 1]]}
+
+
+def test_diff_new_file_and_blank_context(tmp_path):
+    path = write(tmp_path, 'new.diff', '''
+        --- /dev/null
+        +++ b/src/new.c
+        @@ -0,0 +1,2 @@
+        +int one;
+        +int two;
+        --- a/src/keep.c
+        +++ b/src/keep.c
+        @@ -1,3 +1,4 @@
+         a
+
+        +c
+         d
+        ''')
+    assert gcov2html.read_unified_diff(path) == {'src/new.c': [[1, 2]], 'src/keep.c': [[3, 3]]}
+
+
+def test_patch_intervals_match_by_path_suffix():
+    patch = {'src/main.c': [[4, 5], [9, 12]]}
+    intervals = gcov2html.patch_intervals(patch, '/home/ci/project/src/main.c')
+    assert intervals == [[4, 5], [9, 12]]
+    assert gcov2html.patch_intervals(patch, 'main.c') == intervals
+    assert gcov2html.patch_intervals(patch, 'src/other.c') is None
+    assert [n for n in range(1, 14) if gcov2html.in_intervals(intervals, n)] == [4, 5, 9, 10, 11, 12]
+
+
+# ========================
+# summarize_patch
+# ========================
+def test_summarize_patch_against_model(tmp_path):
+    gcov_file = write(tmp_path, 'main.c.gcov', '''
+                -:    0:Source:src/main.c
+                -:    1:#include <stdio.h>
+                1:    2:int main(void) {
+            #####:    3:    if (0) return 1;
+               1*:    4:    puts("x");
+                -:    5:}
+        ''')
+    model = gcov2html.parse_gcov(gcov_file)
+    rows = gcov2html.patch_lines(model, [[1, 4]])
+    assert rows == [(2, 1, 'int main(void) {'), (3, 0, '    if (0) return 1;'), (4, 1, '    puts("x");')]
+
+    reports = [
+        {'relative_path': 'src/main.c', 'html_file': 'src_main.c.html'},
+        {'relative_path': 'src/untouched.c', 'html_file': 'src_untouched.c.html'},
+    ]
+    summary = gcov2html.summarize_patch(reports, {'src_main.c.html': rows}, 80)
+    assert summary['changed'] == 3
+    assert summary['covered'] == 2
+    assert summary['percent'] == 66.67
+    assert not summary['passed']
+    assert summary['files'] == [{
+        'file': 'src/main.c',
+        'html_file': 'src_main.c.html',
+        'changed': 3,
+        'covered': 2,
+        'missed': [(3, '    if (0) return 1;')],
+    }]
+
+
+def test_summarize_patch_without_instrumented_changes_passes():
+    summary = gcov2html.summarize_patch([{'relative_path': 'a.c', 'html_file': 'a.c.html'}], {}, 100)
+    assert summary['passed']
+    assert summary['changed'] == 0
+    assert summary['files'] == []
+
+
+# ========================
+# parse_gcov
+# ========================
+def test_parse_gcov_counts_and_functions(tmp_path):
+    gcov_file = write(tmp_path, 'lib.cpp.gcov', '''
+                -:    0:Source:lib.cpp
+                -:    0:Runs:1
+        function _ZN2ns3fooEv called 3 returned 100% blocks executed 80%
+        function ns::bar(int) called 0 returned 0% blocks executed 0%
+                3:    1:int foo() {
+               2*:    2:    if (x) {
+        branch  0 taken 2
+        branch  1 taken 0
+            =====:    3:        throw 1;
+            #####:    4:    bar(0);
+                -:    5:}
+        ''')
+    model = gcov2html.parse_gcov(gcov_file)
+    assert model['source'] == 'lib.cpp'
+    assert [(num, count, code) for _, num, count, code, _, _ in model['lines']] == [
+        ('0', '-', 'Source:lib.cpp'),
+        ('0', '-', 'Runs:1'),
+        ('1', '3', 'int foo() {'),
+        ('2', '2*', '    if (x) {'),
+        ('3', '=====', '        throw 1;'),
+        ('4', '#####', '    bar(0);'),
+        ('5', '-', '}'),
+    ]
+    assert model['total'] == 4
+    assert model['covered'] == 2
+    assert (model['branch_taken'], model['branch_total']) == (1, 2)
+    assert model['branch_percent'] == 50.0
+    assert model['functions'] == [('_ZN2ns3fooEv', '1', 3), ('ns::bar(int)', '1', 0)]
+    assert model['hot_lines'][0] == (3, '1', 'int foo() {')
+
+
+def test_parse_gcov_without_source_text(tmp_path):
+    gcov_file = write(tmp_path, 'a.c.gcov', '''
+                -:    0:Source:a.c
+                1:    1:int a;
+        ''')
+    model = gcov2html.parse_gcov(gcov_file, decode_source=False)
+    assert model['lines'][1][3] == ''
+    assert (model['covered'], model['total']) == (1, 1)
+    assert gcov2html.parse_gcov(write(tmp_path, 'empty.gcov', ''))['total'] == 0
+
+
+# ========================
+# prune_highlight_cache
+# ========================
+def test_prune_highlight_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(gcov2html, 'HIGHLIGHT_CACHE_DIR', str(tmp_path))
+    for age, name in enumerate(['new', 'mid', 'old']):
+        path = tmp_path / f'{name}.txt'
+        path.write_text('x' * 100)
+        os.utime(path, (1000 - age, 1000 - age))
+    gcov2html.prune_highlight_cache(max_bytes=200)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['mid.txt', 'new.txt']
+
+
+# ========================
+# Lọc theo Source:
+# ========================
+def test_relative_source_resolves_against_gcov_dir(tmp_path):
+    build = tmp_path / 'build'
+    build.mkdir()
+    gcov_file = write(build, 'a.c.gcov', '''
+                -:    0:Source:../src/a.c
+                1:    1:int a;
+        ''')
+    entry = gcov2html.describe_gcov(gcov_file, {'root': str(tmp_path)})
+    assert entry['relative_path'] == os.path.join('src', 'a.c')
+    assert gcov2html.describe_gcov(gcov_file, {'root': str(build)}) is None
+
+
+def test_external_headers_are_dropped_after_parse(tmp_path):
+    gcov_file = write(tmp_path, 'stdio.h.gcov', '''
+                -:    0:Source:/usr/include/stdio.h
+                1:    1:int x;
+        ''')
+    source_filter = {'root': None, 'include': [], 'exclude': [], 'keep_external': False}
+    entry = gcov2html.describe_gcov(gcov_file, source_filter)
+    assert entry is not None
+    assert gcov2html.load_model(entry, source_filter) is None
+    assert gcov2html.load_model(entry, dict(source_filter, keep_external=True))['total'] == 1
+
+
+# ========================
+# ModelFile
+# ========================
+def test_truncated_model_raises_value_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path, 'a.c.gcov', '''
+                -:    0:Source:a.c
+                1:    1:int a;
+            #####:    2:int b;
+        ''')
+    gcov2html.main(['.', '--save-model', 'model.bin', '--log-level', 'error'])
+    data = (tmp_path / 'model.bin').read_bytes()
+    with gcov2html.ModelFile('model.bin') as model:
+        assert model.report(0)['total'] == 2
+
+    for size in (0, 16, gcov2html.MODEL_HEADER.size, len(data) // 2, len(data) - 1):
+        (tmp_path / 'cut.bin').write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            gcov2html.ModelFile('cut.bin')
+
+
+def test_header_groups_resolve_source_against_gcov_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for build in ('build-a', 'build-b'):
+        (tmp_path / build).mkdir()
+        write(tmp_path / build, 'foo.c##util.h.gcov', '''
+                    -:    0:Source:../include/util.h
+                    1:    1:static int util;
+            ''')
+    gcov_files = [os.path.join('build-a', 'foo.c##util.h.gcov'), os.path.join('build-b', 'foo.c##util.h.gcov')]
+    groups = list(gcov2html.consolidate_headers(gcov_files))
+    assert groups == [{'source': os.path.join('include', 'util.h'), 'gcov_files': gcov_files}]
+    entry = gcov2html.describe_record(groups[0], {'root': str(tmp_path)})
+    assert entry['relative_path'] == os.path.join('include', 'util.h')
+
+
+# ========================
+# Ngữ cảnh (--context)
+# ========================
+def test_context_groups_merge_by_resolved_source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for label, count in (('unit', '2'), ('integration', '#####')):
+        (tmp_path / label).mkdir()
+        write(tmp_path / label, 'a.c.gcov', f'''
+                    -:    0:Source:../src/a.c
+                    1:    1:int main(void) {{
+                {count:>5}:    2:    run();
+            ''')
+    groups = gcov2html.discover_context_groups([('unit', 'unit'), ('integration', 'integration')], ['*.gcov'])
+    assert len(groups) == 1
+    assert groups[0]['source'] == os.path.join('src', 'a.c')
+    assert [index for index, _ in groups[0]['contexts']] == [0, 1]
+
+    entry = gcov2html.describe_record(groups[0], {'root': str(tmp_path)})
+    assert entry['relative_path'] == os.path.join('src', 'a.c')
+    model = gcov2html.load_context_group(groups[0])
+    assert (model['covered'], model['total']) == (2, 2)
+    assert model['contexts'] == {1: 0b11, 2: 0b01}
+
+
+# ========================
+# --check / --threshold
+# ========================
+def check_report(path, covered, total, branch_taken=0, branch_total=0):
+    percent = branch_taken / branch_total * 100 if branch_total else 0.0
+    return {'relative_path': path, 'covered': covered, 'total': total, 'branch_taken': branch_taken,
+            'branch_total': branch_total, 'branch_percent': percent}
+
+
+def test_parse_threshold():
+    assert gcov2html.parse_threshold('80') == ('', 80.0, None)
+    assert gcov2html.parse_threshold('src/=60:40') == ('src', 60.0, 40.0)
+    assert gcov2html.parse_threshold('./=:50') == ('', None, 50.0)
+    with pytest.raises(argparse.ArgumentTypeError):
+        gcov2html.parse_threshold('src=high')
+
+
+def test_check_reports_uses_most_specific_threshold():
+    reports = [check_report('src/a.c', 7, 10, 1, 4), check_report('src/core/b.c', 9, 10, 3, 4)]
+    summary = gcov2html.check_reports(reports, [('src', 60.0, 40.0), ('src/core', 95.0, None)])
+    assert not summary['passed']
+    assert summary['failures'] == [
+        {'file': 'src/a.c', 'c0': 70.0, 'c1': 25.0, 'min_c0': 60.0, 'min_c1': 40.0},
+        {'file': 'src/core/b.c', 'c0': 90.0, 'c1': 75.0, 'min_c0': 95.0, 'min_c1': None},
+    ]
+    assert summary['overall'] == {'c0': 80.0, 'c1': 50.0, 'failed': False}
+
+
+def test_check_reports_skips_c1_without_branches():
+    reports = [check_report('src/b.c', 8, 10)]
+    summary = gcov2html.check_reports(reports, [('src', 60.0, 40.0), ('', None, 40.0)])
+    assert summary['passed']
+    assert summary['failures'] == []
+    assert not summary['overall']['failed']
+
+
+def test_check_summary_json(capsys):
+    summary = gcov2html.check_reports([check_report('a.c', 1, 4)], [('', 50.0, None)])
+    gcov2html.print_check_summary(summary, 'json')
+    assert json.loads(capsys.readouterr().out) == {
+        'passed': False,
+        'files': 1,
+        'overall': {'c0': 25.0, 'c1': 0.0, 'failed': True},
+        'failures': [{'file': 'a.c', 'c0': 25.0, 'c1': 0.0, 'min_c0': 50.0, 'min_c1': None}],
+    }
+
+
+# ========================
+# LCOV / Cobertura
+# ========================
+def test_read_lcov_records(tmp_path):
+    path = write(tmp_path, 'a.info', '''
+        TN:
+        SF:/src/a.c
+        FN:1,main
+        FN:5,9,helper
+        FNDA:3,main
+        FNDA:0,helper
+        DA:1,3
+        DA:2,0
+        DA:2,1
+        BRDA:2,0,0,1
+        BRDA:2,0,1,-
+        BRDA:2,0,2,0
+        end_of_record
+        SF:/src/b.c
+        DA:1,-1
+        end_of_record
+        ''')
+    records = list(gcov2html.read_lcov(path))
+    assert records == [
+        {'source': '/src/a.c', 'hits': {1: 3, 2: 1}, 'branches': {2: (1, 3)},
+         'functions': [('main', '1', 3), ('helper', '5', 0)]},
+        {'source': '/src/b.c', 'hits': {1: 0}, 'branches': {}, 'functions': []},
+    ]
+
+
+def test_read_cobertura_records(tmp_path):
+    path = write(tmp_path, 'coverage.xml', '''
+        <?xml version="1.0"?>
+        <coverage>
+          <sources><source>/repo/src</source></sources>
+          <packages><package name="app"><classes>
+            <class name="Program" filename="Program.cs">
+              <methods>
+                <method name="Main" signature="()">
+                  <lines><line number="3" hits="2"/></lines>
+                </method>
+              </methods>
+              <lines>
+                <line number="3" hits="2"/>
+                <line number="4" hits="0" branch="true" condition-coverage="50% (1/2)"/>
+                <line number="x" hits="9"/>
+              </lines>
+            </class>
+          </classes></package></packages>
+        </coverage>
+        ''')
+    assert list(gcov2html.read_cobertura(path)) == [{
+        'source': 'Program.cs', 'hits': {3: 2, 4: 0}, 'branches': {4: (1, 2)},
+        'functions': [('Main', '3', 2)], 'search_dirs': ['/repo/src'],
+    }]
+
+
+def test_function_lines_share_one_parser():
+    assert gcov2html.parse_function_line(b'function ns::f(int) called 7 returned 100% blocks executed 80%') == \
+        ('ns::f(int)', 7)
+    assert gcov2html.parse_function_line(b'function broken') is None
+    assert gcov2html.function_record('main', 'x') == ('main', 0)
+
+
+# ========================
+# BackgroundWriter
+# ========================
+def test_background_writer_keeps_files_in_flight(tmp_path):
+    writer = gcov2html.BackgroundWriter(threads=2)
+    done = []
+    pages = [writer.open(str(tmp_path / f'{n}.html'), lambda n=n: done.append(n)) for n in range(3)]
+    for n, pending in enumerate(pages):
+        writer.write(pending, f'<p>{n}</p>')
+    cancelled = writer.open(str(tmp_path / 'cancelled.html'))
+    writer.write(cancelled, 'partial')
+    writer.finish(cancelled, cancel=True)
+    for pending in pages:
+        writer.finish(pending)
+    blocked = writer.open(str(tmp_path / 'missing' / 'x.html'))
+    writer.write(blocked, 'x')
+    writer.finish(blocked)
+
+    summary = writer.close()
+    assert sorted(done) == [0, 1, 2]
+    assert summary['bytes'] == 3 * len('<p>0</p>')
+    assert summary['failures'] == [str(tmp_path / 'missing' / 'x.html')]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['0.html', '1.html', '2.html']
+
+
+# ========================
+# --compare
+# ========================
+def test_compare_aligns_build_dirs_on_source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for build, count in (('build-debug', '1'), ('build-release', '#####')):
+        (tmp_path / build).mkdir()
+        write(tmp_path / build, 'a.c.gcov', f'''
+                    -:    0:Source:../src/a.c
+                    1:    1:int main(void) {{
+                {count:>5}:    2:    run();
+            ''')
+        gcov2html.main([build, '--save-model', f'{build}.bin', '--log-level', 'error'])
+
+    with gcov2html.ModelFile('build-debug.bin') as debug, gcov2html.ModelFile('build-release.bin') as release:
+        assert list(gcov2html.align_models([debug, release])) == [('../src/a.c', {0: 0, 1: 0})]
+
+    gcov2html.main(['--compare', 'debug=build-debug.bin', '--compare', 'release=build-release.bin',
+                    '--log-level', 'error'])
+    index = (tmp_path / 'coverage_html' / 'index.html').read_text(encoding='utf-8')
+    assert '../src/a.c' in index
+    assert '100.0%' in index and '50.0%' in index
+
+
+# ========================
+# merge_records (--memory-limit)
+# ========================
+def shard_records(shards):
+    for shard in range(shards):
+        for n in range(10):
+            yield {'source': f'src/f{n}.c', 'hits': {1: 1, 2: shard}, 'branches': {2: (shard % 2, 1)},
+                   'functions': [('f', 1, 1)]}
+
+
+def test_merge_records_spills_to_disk_with_same_result():
+    in_memory = {r['source']: r for r in gcov2html.merge_records(shard_records(40))}
+    spilled = list(gcov2html.merge_records(shard_records(40), memory_limit=1))
+    assert [r['source'] for r in spilled] == sorted(in_memory)
+    for record in spilled:
+        expected = in_memory[record['source']]
+        assert record['hits'] == {1: 40, 2: sum(range(40))}
+        assert record['hits'] == expected['hits']
+        assert record['branches'] == expected['branches'] == {2: (1, 1)}
+        assert [tuple(f) for f in record['functions']] == [tuple(f) for f in expected['functions']] == [('f', 1, 40)]
+
+
+def test_parse_size():
+    assert gcov2html.parse_size('512') == 512
+    assert gcov2html.parse_size('2K') == 2048
+    assert gcov2html.parse_size('1.5G') == int(1.5 * 1024 ** 3)
+
+
+# ========================
+# SQLite (--sqlite / --db-query)
+# ========================
+def test_sqlite_export_and_drop_query(tmp_path, monkeypatch, capsys):
+    sqlite3 = pytest.importorskip('sqlite3')
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path, 'a.c.gcov', '''
+                -:    0:Source:a.c
+        function main called 1 returned 100% blocks executed 100%
+                1:    1:int main(void) {
+                1:    2:    return 0;
+        ''')
+    gcov2html.main(['.', '--sqlite', 'cov.db', '--log-level', 'error'])
+    write(tmp_path, 'a.c.gcov', '''
+                -:    0:Source:a.c
+        function main called 0 returned 0% blocks executed 0%
+            #####:    1:int main(void) {
+                1:    2:    return 0;
+        ''')
+    gcov2html.main(['.', '--sqlite', 'cov.db', '--log-level', 'error'])
+
+    db = sqlite3.connect('cov.db')
+    assert db.execute("SELECT COUNT(*) FROM runs").fetchone() == (2,)
+    assert db.execute("SELECT path, covered, total FROM files ORDER BY run_id").fetchall() == [
+        ('a.c', 2, 2), ('a.c', 1, 2)]
+    assert db.execute("SELECT line_no, hits FROM lines ORDER BY line_no").fetchall() == [(1, 0), (2, 1)]
+    assert db.execute("SELECT name, line_no, called FROM functions").fetchall() == [('main', 1, 0)]
+    db.close()
+
+    capsys.readouterr()
+    assert gcov2html.run_db_query('cov.db', 'c0-drop') == 0
+    assert capsys.readouterr().out.splitlines() == ['path\tbefore\tafter', 'a.c\t100.0\t50.0']